@@ -6,6 +6,7 @@ import 'package:sensors_plus/sensors_plus.dart';
 import 'package:flutter_background_service/flutter_background_service.dart';
 import 'package:flutter_background_service_android/flutter_background_service_android.dart';
 import 'dart:convert';
+import 'auth_service.dart';
 
 class AIProtectionService {
   final _storage = const FlutterSecureStorage();
@@ -82,9 +83,13 @@ class AIProtectionService {
 
   Future<void> _checkBehavior() async {
     try {
+      final token = await authService.getToken();
       final response = await http.post(
         Uri.parse(_apiUrl),
-        headers: {'Content-Type': 'application/json'},
+        headers: {
+          'Content-Type': 'application/json',
+          if (token != null) 'Authorization': 'Bearer $token',
+        },
         body: jsonEncode({'data': _behaviorData, 'device_id': _deviceId}),
       );
       final result = jsonDecode(response.body);
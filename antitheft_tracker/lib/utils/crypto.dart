@@ -2,28 +2,41 @@ import 'dart:convert';
 import 'package:encrypt/encrypt.dart' as encrypt;
 import 'constants.dart';
 
+// Payloads are base64(0x02 || nonce(12) || ciphertext || tag(16)) with AES-GCM.
+// The server still accepts the legacy base64(iv(16) || ciphertext) AES-CBC layout.
+const int gcmVersion = 0x02;
+
 class Crypto {
-  final encrypter = encrypt.Encrypter(encrypt.AES(
-    encrypt.Key.fromUtf8(encryptionKey.padRight(32, '\0').substring(0, 32)),
-    mode: encrypt.AESMode.cbc,
-    padding: 'PKCS7',
-  ));
+  final _key = encrypt.Key.fromUtf8(encryptionKey.padRight(32, '\0').substring(0, 32));
+
+  late final gcm = encrypt.Encrypter(encrypt.AES(_key, mode: encrypt.AESMode.gcm, padding: null));
+
+  late final cbc = encrypt.Encrypter(encrypt.AES(_key, mode: encrypt.AESMode.cbc, padding: 'PKCS7'));
 
   String encryptData(Map<String, dynamic> data) {
-    final iv = encrypt.IV.fromSecureRandom(16);
+    final nonce = encrypt.IV.fromSecureRandom(12);
     final jsonString = jsonEncode(data);
-    final encrypted = encrypter.encrypt(jsonString, iv: iv);
-    final combined = iv.bytes + encrypted.bytes;
+    final encrypted = gcm.encrypt(jsonString, iv: nonce);
+    final combined = [gcmVersion, ...nonce.bytes, ...encrypted.bytes];
     return base64Encode(combined);
   }
 
   Map<String, dynamic> decryptData(String encryptedData) {
     final decoded = base64Decode(encryptedData);
+    if (decoded.length >= 29 && decoded[0] == gcmVersion) {
+      try {
+        final nonce = encrypt.IV(decoded.sublist(1, 13));
+        final decrypted = gcm.decrypt(encrypt.Encrypted(decoded.sublist(13)), iv: nonce);
+        return jsonDecode(decrypted);
+      } catch (_) {
+        // A legacy CBC IV can start with the version byte too
+      }
+    }
     final iv = encrypt.IV(decoded.sublist(0, 16));
     final encrypted = decoded.sublist(16);
-    final decrypted = encrypter.decrypt(encrypt.Encrypted(encrypted), iv: iv);
+    final decrypted = cbc.decrypt(encrypt.Encrypted(encrypted), iv: iv);
     return jsonDecode(decrypted);
   }
 }
 
-final crypto = Crypto();
\ No newline at end of file
+final crypto = Crypto();
@@ -0,0 +1,235 @@
+"""Streaming per-device theft-suspicion scoring.
+
+Each device keeps a fixed-size window of its most recent fixes, a reservoir
+sample of its long-term fixes, and a cached k-means model of the places it
+usually is. Scoring a batch of fixes costs one vectorized pass against that
+state, so no call ever scans the device's full history. Every component
+score is in [0, 1]:
+
+* ``speed``     implied speed between consecutive fixes against ``max_speed``
+* ``jump``      distance covered within ``jump_window`` seconds against ``jump_distance``
+* ``geofence``  distance outside the device's explicit geofence, in geofence radii
+* ``cluster``   distance from the nearest usual-location cluster, in cluster radii
+* ``motion``    spread of accelerometer magnitudes in a sensor window
+"""
+import collections
+import math
+import threading
+
+import numpy as np
+
+from geo import haversine_m
+
+
+class DeviceState:
+    def __init__(self, window, reservoir_size, rng):
+        self.lock = threading.Lock()
+        self.times = np.zeros(window)
+        self.lats = np.zeros(window)
+        self.lons = np.zeros(window)
+        self.count = 0
+        self.head = 0
+        self.reservoir = np.zeros((reservoir_size, 2))
+        self.seen = 0
+        self.rng = rng
+        self.centers = None
+        self.radii = None
+        self.fitted_at = 0
+        self.geofence = None
+        self.seeded = False
+        self.first_observed = None
+
+    def append(self, times, lats, lons):
+        window = len(self.times)
+        if len(times) >= window:
+            times, lats, lons = times[-window:], lats[-window:], lons[-window:]
+        slots = (self.head + np.arange(len(times))) % window
+        self.times[slots] = times
+        self.lats[slots] = lats
+        self.lons[slots] = lons
+        self.head = (self.head + len(times)) % window
+        self.count = min(self.count + len(times), window)
+
+    def sample(self, lats, lons):
+        """Reservoir-sample the fixes so the cluster model sees the device's whole life."""
+        size = len(self.reservoir)
+        index = self.seen + np.arange(len(lats))
+        slots = np.where(index < size, index, self.rng.integers(0, index + 1))
+        keep = slots < size
+        self.reservoir[slots[keep]] = np.column_stack((lats, lons))[keep]
+        self.seen += len(lats)
+
+    def last(self):
+        if not self.count:
+            return None
+        i = (self.head - 1) % len(self.times)
+        return self.times[i], self.lats[i], self.lons[i]
+
+
+class AnomalyEngine:
+    def __init__(self, window=256, reservoir_size=2000, max_speed=55.0, jump_distance=2000.0,
+                 jump_window=120.0, clusters=3, min_cluster_radius=150.0, cluster_tolerance=3.0,
+                 min_fit=50, refit_every=500, motion_std=6.0, threshold=0.8, max_devices=5000, seed=None):
+        self.window = window
+        self.reservoir_size = reservoir_size
+        self.max_speed = max_speed
+        self.jump_distance = jump_distance
+        self.jump_window = jump_window
+        self.clusters = clusters
+        self.min_cluster_radius = min_cluster_radius
+        self.cluster_tolerance = cluster_tolerance
+        self.min_fit = min_fit
+        self.refit_every = refit_every
+        self.motion_std = motion_std
+        self.threshold = threshold
+        self.max_devices = max_devices
+        self._rng = np.random.default_rng(seed)
+        self._devices = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def _state(self, device_id):
+        """Return the device's state. Past ``max_devices`` the least recently
+        used device is evicted; it is seeded from storage again when next scored."""
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is not None:
+                self._devices.move_to_end(device_id)
+                return state
+            state = self._devices[device_id] = DeviceState(self.window, self.reservoir_size, self._rng)
+            while self.max_devices > 0 and len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+                self._evictions += 1
+            return state
+
+    def metrics(self):
+        with self._lock:
+            return {"devices": len(self._devices), "max_devices": self.max_devices,
+                    "evictions": self._evictions}
+
+    def needs_seed(self, device_id):
+        return not self._state(device_id).seeded
+
+    def observe(self, device_id, times, lats, lons):
+        """Add accepted fixes (epoch seconds, degrees), oldest first."""
+        state = self._state(device_id)
+        times, lats, lons = (np.asarray(a, dtype=np.float64) for a in (times, lats, lons))
+        with state.lock:
+            if len(times):
+                if state.first_observed is None:
+                    state.first_observed = times.min()
+                state.append(times, lats, lons)
+                state.sample(lats, lons)
+
+    def seed(self, device_id, sample, recent):
+        """Warm a device up from stored history. ``sample`` is a
+        ``(times, lats, lons)`` spread over its long-term fixes and feeds the
+        cluster model, minus any fix at or after the first live one since
+        ``observe`` already counted those; ``recent`` holds its newest fixes
+        and only fills the recent-fix window when live fixes have not already
+        done so. Both oldest first."""
+        state = self._state(device_id)
+        sample_times, sample_lats, sample_lons = (np.asarray(a, dtype=np.float64) for a in sample)
+        times, lats, lons = (np.asarray(a, dtype=np.float64) for a in recent)
+        with state.lock:
+            if len(times) and not state.count:
+                state.append(times, lats, lons)
+            if state.first_observed is not None:
+                older = sample_times < state.first_observed
+                sample_lats, sample_lons = sample_lats[older], sample_lons[older]
+            if len(sample_lats):
+                state.sample(sample_lats, sample_lons)
+            state.seeded = True
+
+    def set_geofence(self, device_id, latitude, longitude, radius):
+        """Set the device's geofence. It lives only in this process's memory,
+        so callers must send it with every request that relies on it."""
+        latitude, longitude, radius = float(latitude), float(longitude), float(radius)
+        if not all(math.isfinite(value) for value in (latitude, longitude, radius)):
+            raise ValueError("geofence latitude, longitude and radius_m must be finite")
+        if radius <= 0:
+            raise ValueError("geofence radius_m must be greater than 0")
+        state = self._state(device_id)
+        with state.lock:
+            state.geofence = (latitude, longitude, radius)
+
+    def _fit(self, state):
+        from sklearn.cluster import KMeans
+
+        points = state.reservoir[:min(state.seen, len(state.reservoir))]
+        # Cluster in local metres so latitude and longitude weigh the same
+        scale = np.array([1.0, np.cos(np.radians(points[:, 0].mean()))])
+        k = min(self.clusters, len(np.unique(points, axis=0)))
+        model = KMeans(n_clusters=k, n_init=3, random_state=0).fit(points * scale)
+        centers = model.cluster_centers_ / scale
+        distances = haversine_m(points[:, 0], points[:, 1],
+                                centers[model.labels_, 0], centers[model.labels_, 1])
+        radii = np.array([
+            np.percentile(distances[model.labels_ == i], 90) if np.any(model.labels_ == i) else 0.0
+            for i in range(k)
+        ])
+        state.centers = centers
+        state.radii = np.maximum(radii, self.min_cluster_radius)
+        state.fitted_at = state.seen
+
+    def score(self, device_id, times=None, lats=None, lons=None, motion=None):
+        """Score ``times``/``lats``/``lons`` (or the device's newest fix when
+        omitted) against the device's state without recording them."""
+        state = self._state(device_id)
+        with state.lock:
+            if state.seen >= self.min_fit and (state.centers is None or
+                                               state.seen - state.fitted_at >= self.refit_every):
+                self._fit(state)
+            last = state.last()
+            if times is None:
+                if last is None:
+                    times, lats, lons = np.zeros(0), np.zeros(0), np.zeros(0)
+                else:
+                    # Re-score the newest fix against the one before it
+                    i = (state.head - np.arange(min(state.count, 2), 0, -1)) % len(state.times)
+                    times, lats, lons = state.times[i], state.lats[i], state.lons[i]
+                    last = None
+            else:
+                times, lats, lons = (np.asarray(a, dtype=np.float64) for a in (times, lats, lons))
+            centers, radii, geofence = state.centers, state.radii, state.geofence
+
+        components = {name: np.zeros(len(times)) for name in ('speed', 'jump', 'geofence', 'cluster')}
+        if len(times):
+            if last is not None:
+                prev_t, prev_lat, prev_lon = (np.concatenate(([p], a)) for p, a in zip(last, (times, lats, lons)))
+            else:
+                prev_t, prev_lat, prev_lon = (np.concatenate((a[:1], a)) for a in (times, lats, lons))
+            distance = haversine_m(prev_lat[:-1], prev_lon[:-1], prev_lat[1:], prev_lon[1:])
+            elapsed = np.abs(prev_t[1:] - prev_t[:-1])
+            components['speed'] = np.clip(distance / np.maximum(elapsed, 1.0) / self.max_speed, 0.0, 1.0)
+            components['jump'] = np.where(elapsed <= self.jump_window,
+                                          np.clip(distance / self.jump_distance, 0.0, 1.0), 0.0)
+            if geofence is not None:
+                outside = haversine_m(lats, lons, geofence[0], geofence[1]) - geofence[2]
+                components['geofence'] = np.clip(outside / geofence[2], 0.0, 1.0)
+            if centers is not None:
+                ratio = (haversine_m(lats[:, None], lons[:, None], centers[None, :, 0], centers[None, :, 1])
+                         / radii[None, :]).min(axis=1)
+                components['cluster'] = np.clip((ratio - 1.0) / (self.cluster_tolerance - 1.0), 0.0, 1.0)
+
+        motion_score = 0.0
+        if motion is not None and len(motion):
+            samples = np.asarray(motion, dtype=np.float64)
+            magnitude = np.linalg.norm(samples[:, :3], axis=1)
+            motion_score = float(np.clip(magnitude.std() / self.motion_std, 0.0, 1.0))
+
+        per_fix = np.max(np.vstack(list(components.values())), axis=0) if len(times) else np.zeros(0)
+        score = max(float(per_fix.max()) if len(per_fix) else 0.0, motion_score)
+        peaks = {name: float(values.max()) if len(values) else 0.0 for name, values in components.items()}
+        peaks['motion'] = motion_score
+        return {
+            "score": round(score, 4),
+            "is_anomaly": score >= self.threshold,
+            "reasons": sorted(name for name, value in peaks.items() if value >= self.threshold),
+            "components": {name: round(value, 4) for name, value in peaks.items()},
+            "fix_scores": np.round(per_fix, 4).tolist(),
+            "model": {
+                "fixes_seen": state.seen,
+                "clusters": 0 if centers is None else len(centers)
+            }
+        }
@@ -1,55 +1,68 @@
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exc as sa_exc
 from flask_bcrypt import Bcrypt
+import click
 import jwt
 import datetime
 from functools import wraps
 from dotenv import load_dotenv
 import os
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
+import threading
+import time
 import base64
 import json
+import numpy as np
+import history
+from ingest_queue import IngestQueue, IngestQueueFull
+from location_cache import InMemoryLatestLocationCache
+from location_stream import location_broker
+from auth_cache import AuthCache, CachedUser
+from location_store import PartitionedLocationStore, TableLocationStore
+from anomaly import AnomalyEngine
+from crypto_utils import crypto
 
 app = Flask(__name__)
 load_dotenv()
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///antitheft.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['UPDATE_BATCH_MAX'] = int(os.getenv('UPDATE_BATCH_MAX', '500'))
+# 'sync' commits inside the request, 'queue' hands rows to a write-behind queue
+app.config['INGEST_MODE'] = os.getenv('INGEST_MODE', 'sync')
+app.config['INGEST_QUEUE_SIZE'] = int(os.getenv('INGEST_QUEUE_SIZE', '10000'))
+app.config['INGEST_BATCH_SIZE'] = int(os.getenv('INGEST_BATCH_SIZE', '200'))
+app.config['INGEST_FLUSH_INTERVAL'] = float(os.getenv('INGEST_FLUSH_INTERVAL', '0.5'))
+app.config['INGEST_BACKPRESSURE'] = os.getenv('INGEST_BACKPRESSURE', 'reject')
+app.config['INGEST_BLOCK_TIMEOUT'] = float(os.getenv('INGEST_BLOCK_TIMEOUT', '1.0'))
+# Seconds a cached latest fix is trusted (0 = until replaced). Set it when running several workers.
+app.config['LATEST_CACHE_TTL'] = float(os.getenv('LATEST_CACHE_TTL', '0'))
+app.config['AUTH_CACHE_SIZE'] = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+# Invalidation on User changes is per process; other workers see them once this many seconds pass
+app.config['AUTH_CACHE_TTL'] = float(os.getenv('AUTH_CACHE_TTL', '60'))
+app.config['HISTORY_PAGE_MAX'] = int(os.getenv('HISTORY_PAGE_MAX', '10000'))
+# Raw rows read per page when the client asks for a downsampled trail
+app.config['HISTORY_SCAN_MAX'] = int(os.getenv('HISTORY_SCAN_MAX', '500000'))
+# 'none' keeps raw fixes in the location table; 'day', 'week' or 'month' uses one table per period
+app.config['LOCATION_PARTITIONING'] = os.getenv('LOCATION_PARTITIONING', 'none')
+# Raw fixes older than this are rolled up (0 = keep raw fixes forever)
+app.config['LOCATION_RAW_RETENTION_DAYS'] = float(os.getenv('LOCATION_RAW_RETENTION_DAYS', '0'))
+app.config['LOCATION_ROLLUP_SECONDS'] = int(os.getenv('LOCATION_ROLLUP_SECONDS', '60'))
+# Rollups older than this are deleted, theft fixes excepted (0 = keep forever)
+app.config['LOCATION_ROLLUP_RETENTION_DAYS'] = float(os.getenv('LOCATION_ROLLUP_RETENTION_DAYS', '0'))
+# Seconds between background maintenance runs (0 = only via `flask maintain-locations`)
+app.config['LOCATION_MAINTENANCE_INTERVAL'] = float(os.getenv('LOCATION_MAINTENANCE_INTERVAL', '3600'))
+app.config['ANOMALY_THRESHOLD'] = float(os.getenv('ANOMALY_THRESHOLD', '0.8'))
+# Metres per second; 55 m/s is about 200 km/h
+app.config['ANOMALY_MAX_SPEED'] = float(os.getenv('ANOMALY_MAX_SPEED', '55'))
+# Days of stored history used to warm up a device the engine has not seen yet
+app.config['ANOMALY_SEED_DAYS'] = float(os.getenv('ANOMALY_SEED_DAYS', '7'))
+# Devices whose scoring state is kept in memory, about 40 KB each (0 = unbounded)
+app.config['ANOMALY_MAX_DEVICES'] = int(os.getenv('ANOMALY_MAX_DEVICES', '5000'))
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 
-# AES key setup
-ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', '').ljust(32, '\0')[:32].encode('utf-8')  # Ensure 32 bytes
-if len(ENCRYPTION_KEY) != 32:
-    raise ValueError(f"ENCRYPTION_KEY must be 32 bytes, got {len(ENCRYPTION_KEY)} bytes")
-
-class Crypto:
-    def __init__(self):
-        self.key = ENCRYPTION_KEY
-
-    def encrypt(self, data):
-        iv = os.urandom(16)  # 16-byte IV
-        cipher = AES.new(self.key, AES.MODE_CBC, iv=iv)
-        padded_data = pad(data.encode('utf-8'), AES.block_size, style='pkcs7')
-        encrypted = cipher.encrypt(padded_data)
-        return base64.b64encode(iv + encrypted).decode('utf-8')
-
-    def decrypt(self, encrypted_data):
-        try:
-            raw = base64.b64decode(encrypted_data)
-            iv = raw[:16]  # First 16 bytes are IV
-            encrypted = raw[16:]
-            cipher = AES.new(self.key, AES.MODE_CBC, iv=iv)
-            decrypted = unpad(cipher.decrypt(encrypted), AES.block_size, style='pkcs7')
-            return decrypted.decode('utf-8')
-        except Exception as e:
-            print(f"Decryption error: {str(e)}")
-            raise Exception(f"Failed to decrypt data: {str(e)}")
-
-crypto = Crypto()
-
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -65,6 +78,150 @@ class Location(db.Model):
     timestamp = db.Column(db.DateTime, nullable=False)
     is_theft = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_location_device_id_timestamp', 'device_id', 'timestamp'),
+    )
+
+class LocationRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    is_theft = db.Column(db.Boolean, default=False)
+    samples = db.Column(db.Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        db.Index('ix_location_rollup_device_id_timestamp', 'device_id', 'timestamp'),
+    )
+
+def days_or_none(days):
+    return datetime.timedelta(days=days) if days > 0 else None
+
+retention = {
+    'raw_retention': days_or_none(app.config['LOCATION_RAW_RETENTION_DAYS']),
+    'rollup_bucket': app.config['LOCATION_ROLLUP_SECONDS'],
+    'rollup_retention': days_or_none(app.config['LOCATION_ROLLUP_RETENTION_DAYS'])
+}
+if app.config['LOCATION_PARTITIONING'] == 'none':
+    location_store = TableLocationStore(Location.__table__, LocationRollup.__table__, **retention)
+else:
+    location_store = PartitionedLocationStore(
+        LocationRollup.__table__, period=app.config['LOCATION_PARTITIONING'], **retention)
+
+# Replaceable with any LatestLocationCache backend
+latest_cache = InMemoryLatestLocationCache(ttl=app.config['LATEST_CACHE_TTL'])
+
+auth_cache = AuthCache(maxsize=app.config['AUTH_CACHE_SIZE'], ttl=app.config['AUTH_CACHE_TTL'])
+
+anomaly_engine = AnomalyEngine(threshold=app.config['ANOMALY_THRESHOLD'], max_speed=app.config['ANOMALY_MAX_SPEED'],
+                               max_devices=app.config['ANOMALY_MAX_DEVICES'])
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    state = db.inspect(target)
+    emails = {target.email, *state.attrs.email.history.deleted}
+    for email in emails:
+        auth_cache.invalidate_email(email)
+    # Invalidate again once the change is visible to other sessions
+    state.session.info.setdefault('auth_cache_invalidate', set()).update(emails)
+
+@db.event.listens_for(db.session, 'do_orm_execute')
+def invalidate_cached_users_on_bulk_change(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            orm_execute_state.bind_mapper is User.__mapper__:
+        auth_cache.clear()
+        orm_execute_state.session.info['auth_cache_clear'] = True
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_cached_users_after_commit(session):
+    if session.info.pop('auth_cache_clear', False):
+        auth_cache.clear()
+    for email in session.info.pop('auth_cache_invalidate', ()):
+        auth_cache.invalidate_email(email)
+
+def init_db():
+    db.create_all()
+    # create_all skips indexes on tables that already exist
+    for index in Location.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    location_store.prepare(db.engine)
+    if isinstance(location_store, PartitionedLocationStore) and \
+            db.session.execute(db.select(Location.id).limit(1)).first() is not None:
+        print("Warning: the location table still holds fixes that partitioned storage does not read; "
+              "move them with `flask --app app migrate-locations`")
+
+def migrate_legacy_locations(batch_size=10000):
+    """Move fixes from the single location table into the partitioned store.
+
+    Works in id order, one committed batch at a time, so it can be stopped
+    and resumed while the app keeps ingesting.
+    """
+    moved = 0
+    with app.app_context():
+        while True:
+            rows = db.session.execute(
+                db.select(Location.__table__).order_by(Location.id).limit(batch_size)).mappings().all()
+            if not rows:
+                return moved
+            location_store.insert_many(db.session, [{
+                'device_id': row['device_id'],
+                'latitude': row['latitude'],
+                'longitude': row['longitude'],
+                'timestamp': row['timestamp'],
+                'is_theft': bool(row['is_theft'])
+            } for row in rows])
+            db.session.execute(db.delete(Location.__table__).where(Location.id <= rows[-1]['id']))
+            db.session.commit()
+            moved += len(rows)
+
+def run_location_maintenance():
+    with app.app_context():
+        return location_store.maintain(db.engine)
+
+def location_maintenance_loop():
+    while True:
+        time.sleep(app.config['LOCATION_MAINTENANCE_INTERVAL'])
+        try:
+            run_location_maintenance()
+        except Exception as e:
+            print(f"Location maintenance error: {str(e)}")
+
+if (location_store.raw_retention or location_store.rollup_retention) and app.config['LOCATION_MAINTENANCE_INTERVAL'] > 0:
+    threading.Thread(target=location_maintenance_loop, name='location-maintenance', daemon=True).start()
+
+@app.cli.command('maintain-locations')
+def maintain_locations_command():
+    """Roll up and expire location history once."""
+    print(json.dumps(run_location_maintenance()))
+
+@app.cli.command('migrate-locations')
+@click.option('--batch-size', default=10000, show_default=True, help='Fixes moved per transaction.')
+def migrate_locations_command(batch_size):
+    """Move fixes from the location table into partitioned storage."""
+    if not isinstance(location_store, PartitionedLocationStore):
+        raise click.ClickException("Set LOCATION_PARTITIONING to day, week or month first")
+    print(json.dumps({"moved": migrate_legacy_locations(batch_size)}))
+
+def authenticate(token):
+    """Decode a bearer token and return a CachedUser for it.
+
+    Verified tokens are cached, so the JWT decode and the User lookup only
+    run on a cache miss.
+    """
+    cached = auth_cache.get(token)
+    if cached is not None:
+        return cached[1]
+    generation = auth_cache.generation()
+    data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+    current_user = User.query.filter_by(email=data['email']).first()
+    if not current_user:
+        raise Exception("User not found")
+    current_user = CachedUser.from_model(current_user)
+    auth_cache.put(token, data, current_user, generation)
+    return current_user
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -72,11 +229,7 @@ def token_required(f):
         if not token or not token.startswith('Bearer '):
             return jsonify({"status": "error", "message": "Token is missing"}), 401
         try:
-            token = token.split(" ")[1]
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(email=data['email']).first()
-            if not current_user:
-                raise Exception("User not found")
+            current_user = authenticate(token.split(" ")[1])
         except Exception as e:
             return jsonify({"status": "error", "message": f"Token is invalid: {str(e)}"}), 401
         return f(current_user, *args, **kwargs)
@@ -100,6 +253,117 @@ def login():
         })
     return jsonify({"status": "error", "message": "Invalid credentials"}), 401
 
+class PingError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def parse_utc_timestamp(value):
+    """Parse an ISO 8601 string into the naive UTC datetime fixes are stored and served as."""
+    timestamp = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def parse_ping(decrypted_data, current_user):
+    """Validate one decrypted ping and return it as a Location row mapping."""
+    if not isinstance(decrypted_data, dict):
+        raise PingError("Ping must be a JSON object")
+
+    device_id = decrypted_data.get('device_id')
+    latitude = decrypted_data.get('latitude')
+    longitude = decrypted_data.get('longitude')
+    timestamp = decrypted_data.get('timestamp')
+    is_theft = decrypted_data.get('is_theft', False)
+
+    # 0.0 is a valid coordinate, so only absent fields count as missing
+    if any(value is None for value in (device_id, latitude, longitude, timestamp)):
+        raise PingError("Missing required fields")
+
+    if device_id != current_user.device_id:
+        print(f"Device ID mismatch: received {device_id}, expected {current_user.device_id}")
+        raise PingError("Device ID mismatch", 403)
+
+    try:
+        return {
+            'device_id': device_id,
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+            'timestamp': parse_utc_timestamp(timestamp),
+            'is_theft': bool(is_theft)
+        }
+    except (TypeError, ValueError, AttributeError) as e:
+        raise PingError(str(e))
+
+def is_location_row_error(e):
+    """Errors caused by the rows themselves rather than by the database being unavailable."""
+    if isinstance(e, (sa_exc.IntegrityError, sa_exc.DataError)):
+        return True
+    # Raised while binding parameters, before anything reaches the database
+    return isinstance(e, (TypeError, ValueError)) or \
+        (isinstance(e, sa_exc.StatementError) and not isinstance(e, sa_exc.DBAPIError))
+
+def write_location_batch(rows):
+    with app.app_context():
+        location_store.insert_many(db.session, rows)
+        db.session.commit()
+
+ingest_queue = None
+if app.config['INGEST_MODE'] == 'queue':
+    ingest_queue = IngestQueue(
+        write_location_batch,
+        maxsize=app.config['INGEST_QUEUE_SIZE'],
+        batch_size=app.config['INGEST_BATCH_SIZE'],
+        flush_interval=app.config['INGEST_FLUSH_INTERVAL'],
+        backpressure=app.config['INGEST_BACKPRESSURE'],
+        block_timeout=app.config['INGEST_BLOCK_TIMEOUT'],
+        is_row_error=is_location_row_error
+    ).start()
+
+def store_locations(rows):
+    """Insert location rows with a single bulk INSERT and one commit.
+
+    In queue mode the rows are handed to the write-behind queue instead and
+    IngestQueueFull is raised when backpressure rejects them. Accepted rows
+    are pushed to the latest-location cache and to stream subscribers either
+    way; theft fixes are streamed even when they arrive out of order.
+    """
+    if not rows:
+        return
+    if ingest_queue is not None:
+        ingest_queue.put_many(rows)
+    else:
+        location_store.insert_many(db.session, rows)
+        db.session.commit()
+    by_device = {}
+    for row in rows:
+        if latest_cache.offer(row) or row['is_theft']:
+            location_broker.publish(row)
+        by_device.setdefault(row['device_id'], []).append(row)
+    for device_id, device_rows in by_device.items():
+        observe_fixes(device_id, device_rows)
+
+def epoch_seconds(timestamps):
+    return np.array(timestamps, dtype='datetime64[ms]').astype(np.int64) / 1000.0
+
+def fix_arrays(rows):
+    """Epoch seconds, latitudes and longitudes of fix mappings, oldest first."""
+    rows = sorted(rows, key=lambda row: row['timestamp'])
+    return (
+        epoch_seconds([row['timestamp'] for row in rows]),
+        [row['latitude'] for row in rows],
+        [row['longitude'] for row in rows]
+    )
+
+def observe_fixes(device_id, rows):
+    anomaly_engine.observe(device_id, *fix_arrays(rows))
+
+def queue_full_response(e):
+    response = jsonify({"status": "error", "message": str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @app.route('/update', methods=['POST'])
 @token_required
 def receive_update(current_user):
@@ -117,53 +381,266 @@ def receive_update(current_user):
         decrypted_data = json.loads(decrypted_json)
         print(f"Decrypted data: {decrypted_data}")
 
-        device_id = decrypted_data.get('device_id')
-        latitude = decrypted_data.get('latitude')
-        longitude = decrypted_data.get('longitude')
-        timestamp = decrypted_data.get('timestamp')
-        is_theft = decrypted_data.get('is_theft', False)
-
-        if not all([device_id, latitude, longitude, timestamp]):
-            return jsonify({"status": "error", "message": "Missing required fields"}), 400
-
-        if device_id != current_user.device_id:
-            print(f"Device ID mismatch: received {device_id}, expected {current_user.device_id}")
-            return jsonify({"status": "error", "message": "Device ID mismatch"}), 403
-
-        timestamp = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-        location = Location(
-            device_id=device_id,
-            latitude=float(latitude),
-            longitude=float(longitude),
-            timestamp=timestamp,
-            is_theft=is_theft
-        )
-        db.session.add(location)
-        db.session.commit()
+        row = parse_ping(decrypted_data, current_user)
+        store_locations([row])
         return jsonify({"status": "success"}), 200
+    except PingError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status_code
+    except IngestQueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route('/update/batch', methods=['POST'])
+@token_required
+def receive_update_batch(current_user):
+    """Accept many pings in one request.
+
+    ``data`` is either a list of encrypted pings (one object each) or a single
+    encrypted JSON array of pings. Every ping is validated on its own; the
+    accepted ones are written with one bulk insert and one commit.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Body must be a JSON object with a 'data' field"}), 400
+    encrypted_data = data.get('data')
+
+    if not encrypted_data:
+        return jsonify({"status": "error", "message": "Missing encrypted data"}), 400
+
+    results = []
+    rows = []
+
+    if isinstance(encrypted_data, str):
+        try:
+            pings = json.loads(crypto.decrypt(encrypted_data))
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        if not isinstance(pings, list):
+            return jsonify({"status": "error", "message": "Encrypted batch must be a JSON array"}), 400
+    elif isinstance(encrypted_data, list):
+        pings = encrypted_data
+    else:
+        return jsonify({"status": "error", "message": "Invalid batch format"}), 400
+
+    if len(pings) > app.config['UPDATE_BATCH_MAX']:
+        return jsonify({
+            "status": "error",
+            "message": f"Batch too large: {len(pings)} > {app.config['UPDATE_BATCH_MAX']}"
+        }), 413
+
+    if isinstance(encrypted_data, list):
+        valid = [isinstance(ping, str) and bool(ping) for ping in pings]
+        decrypted = iter(crypto.decrypt_many([ping for ping, ok in zip(pings, valid) if ok], return_exceptions=True))
+        pings = [next(decrypted) if ok else PingError("Missing encrypted data") for ok in valid]
+
+    for index, ping in enumerate(pings):
+        try:
+            if isinstance(ping, Exception):
+                raise PingError(str(ping))
+            if isinstance(ping, str):
+                try:
+                    ping = json.loads(ping)
+                except ValueError as e:
+                    raise PingError(str(e))
+            rows.append(parse_ping(ping, current_user))
+            results.append({"index": index, "status": "accepted"})
+        except PingError as e:
+            results.append({"index": index, "status": "rejected", "message": e.message})
+
+    try:
+        store_locations(rows)
+    except IngestQueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         db.session.rollback()
         print(f"Error: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 400
 
+    accepted = len(rows)
+    rejected = len(results) - accepted
+    if accepted == 0:
+        status, code = "error", 400
+    elif rejected:
+        status, code = "partial", 200
+    else:
+        status, code = "success", 200
+    return jsonify({
+        "status": status,
+        "accepted": accepted,
+        "rejected": rejected,
+        "results": results
+    }), code
+
+def serialize_fix(fix):
+    return {
+        "device_id": fix['device_id'],
+        "latitude": fix['latitude'],
+        "longitude": fix['longitude'],
+        "timestamp": fix['timestamp'].isoformat() + "Z",
+        "is_theft": fix['is_theft']
+    }
+
 @app.route('/latest', methods=['GET'])
 @token_required
 def get_latest_location(current_user):
-    latest_location = Location.query.filter_by(device_id=current_user.device_id) \
-        .order_by(Location.timestamp.desc()) \
-        .first()
-    if latest_location:
-        return jsonify({
-            "status": "success",
-            "device_id": latest_location.device_id,
-            "latitude": latest_location.latitude,
-            "longitude": latest_location.longitude,
-            "timestamp": latest_location.timestamp.isoformat() + "Z",
-            "is_theft": latest_location.is_theft
-        }), 200
+    latest = latest_cache.get(current_user.device_id)
+    if latest is None:
+        latest = location_store.latest(db.session, current_user.device_id)
+        if latest:
+            latest_cache.offer(latest)
+    if latest:
+        return jsonify({"status": "success", **serialize_fix(latest)}), 200
     return jsonify({"status": "error", "message": "No location data available"}), 404
 
+def encode_cursor(timestamp, location_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{location_id}".encode('utf-8')).decode('utf-8')
+
+def decode_cursor(cursor):
+    timestamp, location_id = base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8').split('|')
+    return datetime.datetime.fromisoformat(timestamp), int(location_id)
+
+@app.route('/history', methods=['GET'])
+@token_required
+def get_history(current_user):
+    """Fixes of the caller's device between ``start`` and ``end``, oldest first.
+
+    Pages are keyset-paginated on (timestamp, id); pass ``next_cursor`` back
+    as ``cursor`` for the next page. ``downsample=dp`` (with ``tolerance`` in
+    metres) or ``downsample=bucket`` (with ``bucket`` in seconds) thins each
+    page on the server, and ``format=polyline`` or ``format=delta`` returns
+    compact arrays in place of one JSON object per fix.
+    """
+    args = request.args
+    try:
+        end = parse_utc_timestamp(args['end']) if args.get('end') else datetime.datetime.utcnow()
+        start = parse_utc_timestamp(args['start']) if args.get('start') else end - datetime.timedelta(days=1)
+        cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+        downsample = args.get('downsample', 'none')
+        output_format = args.get('format', 'json')
+        tolerance = float(args.get('tolerance', 10))
+        bucket = float(args.get('bucket', 60))
+        if downsample == 'none':
+            limit = min(int(args.get('limit', 1000)), app.config['HISTORY_PAGE_MAX'])
+        else:
+            limit = min(int(args.get('limit', app.config['HISTORY_SCAN_MAX'])), app.config['HISTORY_SCAN_MAX'])
+    except (KeyError, TypeError, ValueError, UnicodeDecodeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {str(e)}"}), 400
+    if downsample not in ('none', 'dp', 'bucket'):
+        return jsonify({"status": "error", "message": "downsample must be none, dp or bucket"}), 400
+    if output_format not in ('json', 'polyline', 'delta'):
+        return jsonify({"status": "error", "message": "format must be json, polyline or delta"}), 400
+    if limit <= 0 or tolerance < 0 or bucket <= 0:
+        return jsonify({"status": "error", "message": "limit, tolerance and bucket must be positive"}), 400
+
+    rows = location_store.history(db.session, current_user.device_id, start, end, cursor, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    times = np.array([row.timestamp for row in rows], dtype='datetime64[ms]')
+    latitudes = np.array([row.latitude for row in rows], dtype=np.float64)
+    longitudes = np.array([row.longitude for row in rows], dtype=np.float64)
+    thefts = np.array([bool(row.is_theft) for row in rows], dtype=bool)
+
+    if downsample == 'dp':
+        keep = history.douglas_peucker(latitudes, longitudes, tolerance, always=thefts)
+    elif downsample == 'bucket':
+        keep = history.time_buckets(times, bucket, always=thefts)
+    else:
+        keep = None
+    if keep is not None:
+        times, latitudes, longitudes, thefts = times[keep], latitudes[keep], longitudes[keep], thefts[keep]
+
+    response = {
+        "status": "success",
+        "device_id": current_user.device_id,
+        "count": len(times),
+        "scanned": len(rows),
+        "next_cursor": next_cursor,
+        "format": output_format
+    }
+    if output_format == 'json':
+        response["points"] = [{
+            "timestamp": str(t) + "Z",
+            "latitude": lat,
+            "longitude": lon,
+            "is_theft": theft
+        } for t, lat, lon, theft in zip(times, latitudes.tolist(), longitudes.tolist(), thefts.tolist())]
+    else:
+        if output_format == 'polyline':
+            response["polyline"] = history.encode_polyline(latitudes, longitudes)
+            response["time_deltas"] = history.delta_encode(times, latitudes, longitudes)["time_deltas"]
+        else:
+            response.update(history.delta_encode(times, latitudes, longitudes))
+        response["theft"] = np.flatnonzero(thefts).tolist()
+    return jsonify(response), 200
+
+@app.route('/detect_anomaly', methods=['POST'])
+@token_required
+def detect_anomaly(current_user):
+    """Theft suspicion for the caller's device.
+
+    Optional body fields: ``fixes`` (plain ``{latitude, longitude, timestamp}``
+    objects to score; the device's newest fix is scored when omitted),
+    ``data`` (accelerometer window, one ``[x, y, z, ...]`` row per sample) and
+    ``geofence`` (``{latitude, longitude, radius_m}``, kept for later calls).
+    """
+    data = request.get_json(silent=True) or {}
+    device_id = current_user.device_id
+    if data.get('device_id') not in (None, device_id):
+        return jsonify({"status": "error", "message": "Device ID mismatch"}), 403
+
+    try:
+        geofence = data.get('geofence')
+        if geofence:
+            anomaly_engine.set_geofence(device_id, float(geofence['latitude']), float(geofence['longitude']),
+                                        float(geofence['radius_m']))
+        times = lats = lons = None
+        if data.get('fixes'):
+            fixes = sorted(({
+                'timestamp': parse_utc_timestamp(fix['timestamp']),
+                'latitude': float(fix['latitude']),
+                'longitude': float(fix['longitude'])
+            } for fix in data['fixes']), key=lambda fix: fix['timestamp'])
+            times = epoch_seconds([fix['timestamp'] for fix in fixes])
+            lats = [fix['latitude'] for fix in fixes]
+            lons = [fix['longitude'] for fix in fixes]
+        motion = data.get('data')
+        if motion is not None:
+            motion = np.asarray(motion, dtype=np.float64)
+            if motion.ndim != 2 or motion.shape[1] < 3:
+                raise ValueError("data must be a list of [x, y, z, ...] samples")
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid request: {str(e)}"}), 400
+
+    if anomaly_engine.needs_seed(device_id):
+        end = datetime.datetime.utcnow()
+        start = end - datetime.timedelta(days=app.config['ANOMALY_SEED_DAYS'])
+        sample = location_store.sample(db.session, device_id, start, end, anomaly_engine.reservoir_size)
+        recent = location_store.recent(db.session, device_id, start, end, anomaly_engine.window)
+        anomaly_engine.seed(device_id, fix_arrays([row._asdict() for row in sample]),
+                            fix_arrays([row._asdict() for row in recent]))
+
+    result = anomaly_engine.score(device_id, times, lats, lons, motion)
+    return jsonify({"status": "success", "device_id": device_id, **result}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "ingest": ingest_queue.metrics() if ingest_queue is not None else {"mode": "sync"},
+        "latest_cache": latest_cache.metrics(),
+        "stream": location_broker.metrics(),
+        "auth_cache": auth_cache.metrics(),
+        "storage": location_store.metrics(),
+        "anomaly": anomaly_engine.metrics()
+    }), 200
+
 if __name__ == "__main__":
     with app.app_context():
-        db.create_all()
+        init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
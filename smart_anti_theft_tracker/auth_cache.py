@@ -0,0 +1,113 @@
+import collections
+import hashlib
+import threading
+import time
+
+
+class CachedUser:
+    """The fields of a User that protected routes need, detached from any session."""
+
+    __slots__ = ('id', 'email', 'device_id', 'is_stolen')
+
+    def __init__(self, id, email, device_id, is_stolen):
+        self.id = id
+        self.email = email
+        self.device_id = device_id
+        self.is_stolen = is_stolen
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.id, user.email, user.device_id, bool(user.is_stolen))
+
+
+class AuthCache:
+    """Bounded TTL/LRU cache of verified bearer tokens.
+
+    Entries are keyed by a SHA-256 fingerprint of the token, never the token
+    itself, and hold the decoded claims plus a ``CachedUser``. An entry lives
+    for at most ``ttl`` seconds and never past the token's ``exp`` claim.
+    ``invalidate_email`` drops every entry for a user when their row changes.
+
+    Take ``generation()`` before reading the user from the database and pass
+    it to ``put``; the entry is skipped if an invalidation happened in
+    between, so a concurrent update cannot be overwritten by a stale read.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._by_email = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def fingerprint(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        """Return ``(claims, user)`` for a cached token or None."""
+        key = self.fingerprint(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1], entry[2]
+                self._remove(key)
+            self._misses += 1
+            return None
+
+    def generation(self):
+        return self._invalidations
+
+    def put(self, token, claims, user, generation=None):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        expires = time.time() + self.ttl
+        if claims.get('exp') is not None:
+            expires = min(expires, claims['exp'])
+        key = self.fingerprint(token)
+        with self._lock:
+            if generation is not None and generation != self._invalidations:
+                return
+            self._remove(key)
+            self._entries[key] = (expires, claims, user)
+            self._by_email.setdefault(user.email, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_email(self, email):
+        with self._lock:
+            for key in self._by_email.pop(email, ()):
+                self._entries.pop(key, None)
+            self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_email.clear()
+            self._invalidations += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_email.get(entry[2].email)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_email[entry[2].email]
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "capacity": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations
+            }
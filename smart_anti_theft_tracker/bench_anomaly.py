@@ -0,0 +1,86 @@
+"""Throughput of the anomaly engine when scoring batches of pings.
+
+Usage:
+    python bench_anomaly.py [--devices 1000] [--history 500] [--batch 1 10 100]
+
+Every device is warmed up with --history fixes around two usual places, the
+cluster models are fitted, and then batches of new pings are scored round-robin
+across devices. Reports pings scored per second for each batch size, plus the
+cost of the one-off model fit and of observing accepted pings.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from anomaly import AnomalyEngine
+
+
+def synthetic_fixes(rng, count, start, spacing=5.0):
+    homes = rng.uniform([-7.0, 39.0], [-6.5, 39.5], size=(2, 2))
+    which = (np.arange(count) // 100) % 2
+    lats = homes[which, 0] + rng.normal(0, 3e-4, count)
+    lons = homes[which, 1] + rng.normal(0, 3e-4, count)
+    times = start + spacing * np.arange(count)
+    return times, lats, lons
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=500)
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--pings', type=int, default=200000, help='pings scored per batch size')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    engine = AnomalyEngine(seed=0)
+    devices = [f"bench-{i}" for i in range(args.devices)]
+    start = time.time() - 86400
+
+    started = time.perf_counter()
+    last = {}
+    for device_id in devices:
+        times, lats, lons = synthetic_fixes(rng, args.history, start)
+        engine.observe(device_id, times, lats, lons)
+        last[device_id] = (times[-1], lats[-1], lons[-1])
+    observe_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for device_id in devices:
+        engine.score(device_id)
+    fit_elapsed = time.perf_counter() - started
+
+    results = {
+        'devices': args.devices,
+        'observe_pings_per_s': round(args.devices * args.history / observe_elapsed, 1),
+        'fit_ms_per_device': round(fit_elapsed / args.devices * 1000, 3),
+        'score': []
+    }
+    for batch in args.batch:
+        calls = max(1, args.pings // batch)
+        payloads = []
+        for i in range(min(calls, args.devices)):
+            device_id = devices[i]
+            t, lat, lon = last[device_id]
+            payloads.append((device_id, t + 5.0 * np.arange(1, batch + 1),
+                             lat + rng.normal(0, 3e-4, batch), lon + rng.normal(0, 3e-4, batch)))
+        started = time.perf_counter()
+        anomalies = 0
+        for i in range(calls):
+            device_id, times, lats, lons = payloads[i % len(payloads)]
+            anomalies += engine.score(device_id, times, lats, lons)['is_anomaly']
+        elapsed = time.perf_counter() - started
+        results['score'].append({
+            'batch': batch,
+            'calls': calls,
+            'pings_per_s': round(calls * batch / elapsed, 1),
+            'us_per_call': round(elapsed / calls * 1e6, 2),
+            'anomalous_calls': int(anomalies)
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
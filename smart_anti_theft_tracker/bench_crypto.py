@@ -0,0 +1,55 @@
+"""Pings decrypted per second on one core.
+
+Usage:
+    python bench_crypto.py [--pings 20000]
+
+Compares the per-call path (``Crypto.decrypt`` in a loop, as /update does)
+with ``Crypto.decrypt_many`` (as /update/batch does), for legacy CBC and
+version 2 GCM payloads.
+"""
+import argparse
+import datetime
+import json
+import time
+
+from crypto_utils import Crypto, MODE_CBC, MODE_GCM
+
+
+def sample_ping(i):
+    return json.dumps({
+        'device_id': 'bench-device',
+        'latitude': -6.8 + i * 1e-6,
+        'longitude': 39.28 + i * 1e-6,
+        'timestamp': (datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=2 * i)).isoformat(),
+        'is_theft': False
+    })
+
+
+def rate(count, run):
+    started = time.perf_counter()
+    run()
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pings', type=int, default=20000)
+    args = parser.parse_args()
+
+    crypto = Crypto()
+    plaintexts = [sample_ping(i) for i in range(args.pings)]
+
+    results = []
+    for mode in (MODE_CBC, MODE_GCM):
+        payloads = [crypto.encrypt(p, mode=mode) for p in plaintexts]
+        assert crypto.decrypt_many(payloads) == plaintexts
+        results.append({
+            'mode': mode,
+            'decrypt_per_s': round(rate(len(payloads), lambda: [crypto.decrypt(p) for p in payloads]), 1),
+            'decrypt_many_per_s': round(rate(len(payloads), lambda: crypto.decrypt_many(payloads)), 1)
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Compare rows/s of the single-ping /update path against /update/batch.
+
+Usage:
+    python bench_ingest.py                       # SQLite only
+    python bench_ingest.py --postgres postgresql://user:pw@localhost:5432/antitheft_db
+
+Every database is benchmarked in its own subprocess because app.py binds
+DATABASE_URL at import time.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_EMAIL = 'bench@ingest.local'
+BENCH_DEVICE = 'bench-ingest-device'
+
+
+def make_pings(count):
+    start = datetime.datetime.utcnow()
+    pings = []
+    for i in range(count):
+        pings.append({
+            'device_id': BENCH_DEVICE,
+            'latitude': -6.8 + i * 1e-5,
+            'longitude': 39.28 + i * 1e-5,
+            'timestamp': (start + datetime.timedelta(seconds=2 * i)).isoformat() + 'Z',
+            'is_theft': False
+        })
+    return pings
+
+
+def run_worker(database_url, count, batch_size):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('SECRET_KEY', 'bench-only-secret-key-0123456789abcdef')
+    import jwt
+    from app import app, db, crypto, init_db, User, Location
+
+    with app.app_context():
+        init_db()
+        Location.query.filter_by(device_id=BENCH_DEVICE).delete()
+        User.query.filter_by(email=BENCH_EMAIL).delete()
+        db.session.add(User(email=BENCH_EMAIL, device_id=BENCH_DEVICE, password='x'))
+        db.session.commit()
+
+    token = jwt.encode({
+        'email': BENCH_EMAIL,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    }, app.config['SECRET_KEY'], algorithm="HS256")
+    headers = {'Authorization': f'Bearer {token}'}
+    client = app.test_client()
+    pings = make_pings(count)
+
+    single = [crypto.encrypt(json.dumps(p)) for p in pings]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        for payload in single:
+            response = client.post('/update', json={'data': payload}, headers=headers)
+            assert response.status_code == 200, response.get_json()
+    single_elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        Location.query.filter_by(device_id=BENCH_DEVICE).delete()
+        db.session.commit()
+
+    batches = [single[i:i + batch_size] for i in range(0, count, batch_size)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        for batch in batches:
+            response = client.post('/update/batch', json={'data': batch}, headers=headers)
+            assert response.get_json()['accepted'] == len(batch), response.get_json()
+    batch_elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        Location.query.filter_by(device_id=BENCH_DEVICE).delete()
+        User.query.filter_by(email=BENCH_EMAIL).delete()
+        db.session.commit()
+
+    print(json.dumps({
+        'database': database_url.split(':', 1)[0],
+        'rows': count,
+        'batch_size': batch_size,
+        'single_rows_per_s': round(count / single_elapsed, 1),
+        'batch_rows_per_s': round(count / batch_elapsed, 1),
+        'speedup': round(single_elapsed / batch_elapsed, 2)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--postgres', help='PostgreSQL DATABASE_URL to benchmark as well')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.rows, args.batch_size)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        urls = [f"sqlite:///{os.path.join(tmp, 'bench.db')}"]
+        if args.postgres:
+            urls.append(args.postgres)
+        for url in urls:
+            subprocess.run([
+                sys.executable, __file__, '--worker', url,
+                '--rows', str(args.rows), '--batch-size', str(args.batch_size)
+            ], check=True)
+
+
+if __name__ == '__main__':
+    main()
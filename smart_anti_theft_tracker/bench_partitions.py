@@ -0,0 +1,134 @@
+"""Insert and newest-fix latency as location history grows, single table vs partitioned.
+
+Usage:
+    python bench_partitions.py [--steps 4] [--rows-per-step 500000] [--period day]
+    python bench_partitions.py --postgres postgresql://user:pw@localhost:5432/bench_db
+
+After each growth step the benchmark times a 100-row insert at the head of
+history and a cold (uncached) newest-fix lookup for random devices. Use a
+throwaway database: every table of the app is dropped first and at the end. Scale
+--rows-per-step up to reach hundreds of millions of rows.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def make_rows(devices, start, count, spacing):
+    rows = []
+    for i in range(count):
+        rows.append({
+            'device_id': f"bench-{i % devices}",
+            'latitude': -6.8 + random.random() * 0.1,
+            'longitude': 39.2 + random.random() * 0.1,
+            'timestamp': start + datetime.timedelta(seconds=spacing * (i // devices)),
+            'is_theft': False
+        })
+    return rows
+
+
+def median_ms(samples):
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def drop_tables(db):
+    import sqlalchemy as sa
+    db.drop_all()
+    cascade = ' CASCADE' if db.engine.dialect.name == 'postgresql' else ''
+    for name in sa.inspect(db.engine).get_table_names():
+        if name.startswith('location_raw') or name == 'location_store_state':
+            db.session.execute(sa.text(f"DROP TABLE IF EXISTS {name}{cascade}"))
+    db.session.commit()
+
+
+def run_worker(args, database_url, partitioning):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['LOCATION_PARTITIONING'] = partitioning
+    from app import app, db, init_db, location_store
+
+    with app.app_context():
+        drop_tables(db)
+        init_db()
+
+        # 2 s between a device's fixes, like a phone in theft mode
+        spacing = 2
+        clock = datetime.datetime(2024, 1, 1)
+        total = 0
+        for step in range(1, args.steps + 1):
+            for offset in range(0, args.rows_per_step, args.chunk):
+                count = min(args.chunk, args.rows_per_step - offset)
+                rows = make_rows(args.devices, clock, count, spacing)
+                location_store.insert_many(db.session, rows)
+                db.session.commit()
+                clock = rows[-1]['timestamp'] + datetime.timedelta(seconds=spacing)
+            total += args.rows_per_step
+
+            insert_samples = []
+            for _ in range(args.samples):
+                rows = make_rows(args.devices, clock, 100, spacing)
+                started = time.perf_counter()
+                location_store.insert_many(db.session, rows)
+                db.session.commit()
+                insert_samples.append(time.perf_counter() - started)
+                clock = rows[-1]['timestamp'] + datetime.timedelta(seconds=spacing)
+
+            latest_samples = []
+            for _ in range(args.samples):
+                device_id = f"bench-{random.randrange(args.devices)}"
+                started = time.perf_counter()
+                fix = location_store.latest(db.session, device_id)
+                latest_samples.append(time.perf_counter() - started)
+                assert fix is not None
+            db.session.rollback()
+
+            print(json.dumps({
+                'database': db.engine.dialect.name,
+                'storage': partitioning,
+                'step': step,
+                'rows': total,
+                'insert_100_ms': median_ms(insert_samples),
+                'latest_ms': median_ms(latest_samples)
+            }), flush=True)
+
+        drop_tables(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--rows-per-step', type=int, default=500000)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--chunk', type=int, default=50000)
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--period', default='day', choices=['day', 'week', 'month'])
+    parser.add_argument('--postgres', help='PostgreSQL DATABASE_URL of a throwaway database')
+    parser.add_argument('--worker', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args, *args.worker)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        urls = [f"sqlite:///{os.path.join(tmp, 'bench.db')}"]
+        if args.postgres:
+            urls.append(args.postgres)
+        for url in urls:
+            for partitioning in ('none', args.period):
+                subprocess.run([
+                    sys.executable, __file__, '--worker', url, partitioning,
+                    '--steps', str(args.steps), '--rows-per-step', str(args.rows_per_step),
+                    '--devices', str(args.devices), '--chunk', str(args.chunk),
+                    '--samples', str(args.samples)
+                ], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,134 @@
 from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
+from Crypto.Util.Padding import pad
+from Crypto.Random import get_random_bytes
+import binascii
 import base64
+import numpy as np
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', '').ljust(32, '\0')[:32].encode('utf-8')  # Ensure 32 bytes
+if len(ENCRYPTION_KEY) != 32:
+    raise ValueError(f"ENCRYPTION_KEY must be 32 bytes, got {len(ENCRYPTION_KEY)} bytes")
+
+MODE_CBC = 'cbc'
+MODE_GCM = 'gcm'
+
+# Payload layouts (base64 encoded):
+#   CBC, legacy clients:  iv(16) || ciphertext, PKCS7 padded
+#   GCM, version 2:       0x02 || nonce(12) || ciphertext || tag(16)
+GCM_VERSION = 0x02
+GCM_NONCE_SIZE = 12
+GCM_TAG_SIZE = 16
+
+
+class DecryptionError(Exception):
+    pass
+
 
 class Crypto:
-    def __init__(self):
-        self.key = ENCRYPTION_KEY
+    """AES-256 for location pings.
+
+    ``encrypt`` produces version 2 AES-GCM payloads. ``decrypt`` and
+    ``decrypt_many`` accept those and, while ``allow_cbc`` is set, legacy
+    AES-CBC payloads from clients that predate GCM. CBC is decrypted with one
+    keyed AES-ECB cipher per thread: every ciphertext block of a batch goes
+    through a single ECB call and the CBC chaining is one NumPy XOR, so no
+    cipher is built per ping and no per-ping slices are copied.
+    """
+
+    def __init__(self, key=ENCRYPTION_KEY, allow_cbc=True):
+        self.key = key
+        self.allow_cbc = allow_cbc
+        self._local = threading.local()
 
-    def encrypt(self, data):
-        iv = os.urandom(16)  # 16-byte IV
-        cipher = AES.new(self.key, AES.MODE_CBC, iv=iv)
-        padded_data = pad(data.encode('utf-8'), AES.block_size, style='pkcs7')
-        encrypted = cipher.encrypt(padded_data)
-        return base64.b64encode(iv + encrypted).decode('utf-8')
+    def _ecb(self):
+        cipher = getattr(self._local, 'ecb', None)
+        if cipher is None:
+            cipher = self._local.ecb = AES.new(self.key, AES.MODE_ECB)
+        return cipher
+
+    def encrypt(self, data, mode=MODE_GCM):
+        if mode == MODE_CBC:
+            iv = get_random_bytes(16)
+            padded_data = pad(data.encode('utf-8'), AES.block_size, style='pkcs7')
+            encrypted = AES.new(self.key, AES.MODE_CBC, iv=iv).encrypt(padded_data)
+            return base64.b64encode(iv + encrypted).decode('utf-8')
+        nonce = get_random_bytes(GCM_NONCE_SIZE)
+        encrypted, tag = AES.new(self.key, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(data.encode('utf-8'))
+        return base64.b64encode(bytes([GCM_VERSION]) + nonce + encrypted + tag).decode('utf-8')
 
     def decrypt(self, encrypted_data):
-        try:
-            raw = base64.b64decode(encrypted_data)
-            iv = raw[:16]  # First 16 bytes are IV
-            encrypted = raw[16:]
-            cipher = AES.new(self.key, AES.MODE_CBC, iv=iv)
-            decrypted = unpad(cipher.decrypt(encrypted), AES.block_size, style='pkcs7')
-            return decrypted.decode('utf-8')
-        except Exception as e:
-            print(f"Decryption error: {str(e)}")
-            raise Exception(f"Failed to decrypt data: {str(e)}")
-
-crypto = Crypto()
\ No newline at end of file
+        result = self._decrypt_batch([encrypted_data])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def decrypt_many(self, payloads, return_exceptions=False):
+        """Decrypt a list of payloads, in order.
+
+        With ``return_exceptions`` a payload that fails yields its
+        DecryptionError in place of the plaintext, otherwise the first failure
+        is raised.
+        """
+        results = self._decrypt_batch(list(payloads))
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def _decrypt_batch(self, payloads):
+        results = [None] * len(payloads)
+        cbc = []
+        for index, payload in enumerate(payloads):
+            try:
+                raw = memoryview(binascii.a2b_base64(payload))
+            except (binascii.Error, TypeError, ValueError) as e:
+                results[index] = DecryptionError(f"Failed to decrypt data: {str(e)}")
+                continue
+            cbc_shaped = len(raw) >= 32 and len(raw) % AES.block_size == 0
+            if len(raw) >= 1 + GCM_NONCE_SIZE + GCM_TAG_SIZE and raw[0] == GCM_VERSION:
+                try:
+                    cipher = AES.new(self.key, AES.MODE_GCM, nonce=raw[1:1 + GCM_NONCE_SIZE])
+                    plain = cipher.decrypt_and_verify(raw[1 + GCM_NONCE_SIZE:-GCM_TAG_SIZE], raw[-GCM_TAG_SIZE:])
+                    results[index] = plain.decode('utf-8')
+                    continue
+                except (ValueError, UnicodeDecodeError) as e:
+                    # A CBC IV starts with 0x02 one time in 256
+                    if not (self.allow_cbc and cbc_shaped):
+                        results[index] = DecryptionError(f"Failed to decrypt data: {str(e)}")
+                        continue
+            if not self.allow_cbc:
+                results[index] = DecryptionError("Failed to decrypt data: CBC payloads are no longer accepted")
+            elif not cbc_shaped:
+                results[index] = DecryptionError("Failed to decrypt data: invalid payload length")
+            else:
+                cbc.append((index, raw))
+        if cbc:
+            self._decrypt_cbc(cbc, results)
+        return results
+
+    def _decrypt_cbc(self, items, results):
+        # D_k(C_i) XOR C_(i-1), with the IV as C_0, for every block of every payload at once
+        blocks = self._ecb().decrypt(b''.join(raw[16:] for _, raw in items))
+        chained = b''.join(raw[:-16] for _, raw in items)
+        plain = memoryview((np.frombuffer(blocks, dtype=np.uint8) ^ np.frombuffer(chained, dtype=np.uint8)).tobytes())
+        offset = 0
+        for index, raw in items:
+            size = len(raw) - 16
+            message = plain[offset:offset + size]
+            offset += size
+            padding = message[-1]
+            if not 1 <= padding <= AES.block_size or message[-padding:] != bytes([padding]) * padding:
+                results[index] = DecryptionError("Failed to decrypt data: Padding is incorrect.")
+                continue
+            try:
+                results[index] = str(message[:-padding], 'utf-8')
+            except UnicodeDecodeError as e:
+                results[index] = DecryptionError(f"Failed to decrypt data: {str(e)}")
+
+
+crypto = Crypto(allow_cbc=os.getenv('CRYPTO_ALLOW_CBC', '1') != '0')
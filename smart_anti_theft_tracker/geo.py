@@ -0,0 +1,20 @@
+"""Distances on the Earth's surface, vectorized with NumPy."""
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres; arguments broadcast like NumPy arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def to_local_metres(latitudes, longitudes):
+    """Equirectangular projection around the points' mean latitude."""
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    x = lon * np.cos(lat.mean()) * EARTH_RADIUS_M
+    y = lat * EARTH_RADIUS_M
+    return x, y
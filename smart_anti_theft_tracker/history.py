@@ -0,0 +1,93 @@
+"""Downsampling and compact encodings for location trails.
+
+A trail is four equal-length NumPy arrays: ``times`` (datetime64[ms]),
+``latitudes``, ``longitudes`` and ``thefts`` (bool). The downsamplers return
+sorted indices into those arrays so the caller can pick the surviving rows;
+rows flagged in the optional ``always`` mask (theft fixes) always survive.
+"""
+import numpy as np
+
+from geo import to_local_metres
+
+
+def douglas_peucker(latitudes, longitudes, tolerance, always=None):
+    """Indices of the points kept by Douglas–Peucker with ``tolerance`` metres.
+
+    Iterative, with the perpendicular distances of each segment computed in
+    one vectorized pass. Points in ``always`` are kept and anchor the
+    simplification like the endpoints do.
+    """
+    n = len(latitudes)
+    if n < 3:
+        return np.arange(n)
+    x, y = to_local_metres(latitudes, longitudes)
+    keep = np.zeros(n, dtype=bool) if always is None else np.asarray(always, dtype=bool).copy()
+    keep[0] = keep[-1] = True
+    anchors = np.flatnonzero(keep)
+    stack = list(zip(anchors[:-1].tolist(), anchors[1:].tolist()))
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def time_buckets(times, bucket_seconds, always=None):
+    """Indices of the last fix in every ``bucket_seconds`` wide time bucket,
+    plus every point in ``always``."""
+    if len(times) == 0:
+        return np.arange(0)
+    epoch_ms = times.astype('datetime64[ms]').astype(np.int64)
+    buckets = epoch_ms // int(bucket_seconds * 1000)
+    keep = np.flatnonzero(np.append(buckets[1:] != buckets[:-1], True))
+    if always is not None:
+        keep = np.union1d(keep, np.flatnonzero(always))
+    return keep
+
+
+def encode_polyline(latitudes, longitudes, precision=5):
+    """Google encoded polyline of the given coordinates."""
+    factor = 10 ** precision
+    coords = np.column_stack((
+        np.round(np.asarray(latitudes) * factor),
+        np.round(np.asarray(longitudes) * factor)
+    )).astype(np.int64)
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    chunks = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def delta_encode(times, latitudes, longitudes, scale=100000):
+    """Integer delta arrays: the first element is absolute, the rest are
+    differences. Times are milliseconds since the epoch, coordinates are
+    multiplied by ``scale``."""
+    epoch_ms = times.astype('datetime64[ms]').astype(np.int64)
+    lat = np.round(np.asarray(latitudes) * scale).astype(np.int64)
+    lon = np.round(np.asarray(longitudes) * scale).astype(np.int64)
+    return {
+        "scale": scale,
+        "time_deltas": np.diff(epoch_ms, prepend=0).tolist(),
+        "lat_deltas": np.diff(lat, prepend=0).tolist(),
+        "lon_deltas": np.diff(lon, prepend=0).tolist()
+    }
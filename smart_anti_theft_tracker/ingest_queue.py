@@ -0,0 +1,209 @@
+import atexit
+import collections
+import threading
+import time
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+def is_value_error(e):
+    return isinstance(e, (TypeError, ValueError))
+
+
+class IngestQueue:
+    """Bounded write-behind queue for location rows.
+
+    Request handlers call ``put_many`` and return as soon as the rows are
+    queued. A background writer thread drains the queue in micro-batches of
+    up to ``batch_size`` rows, or whatever is pending after ``flush_interval``
+    seconds, and hands each batch to ``write_batch``.
+
+    A write that fails with an error ``is_row_error`` blames on the rows
+    (constraint violations, bad values) bisects the batch until the rows that
+    cannot be written on their own are isolated; those are dead-lettered
+    (logged and counted) and the rest are written. Any other error is taken
+    as the database being unavailable: whatever is still unwritten goes back
+    to the head of the queue and is retried with backoff, so an outage fills
+    the queue and triggers backpressure instead of losing rows.
+
+    ``backpressure`` is ``'reject'`` (raise ``IngestQueueFull`` straight away)
+    or ``'block'`` (wait up to ``block_timeout`` seconds for room first).
+    """
+
+    def __init__(self, write_batch, maxsize=10000, batch_size=200, flush_interval=0.5,
+                 backpressure='reject', block_timeout=1.0, is_row_error=is_value_error):
+        if backpressure not in ('reject', 'block'):
+            raise ValueError(f"backpressure must be 'reject' or 'block', got {backpressure!r}")
+        self.write_batch = write_batch
+        self.is_row_error = is_row_error
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._stopping = False
+        self._thread = None
+
+        self._enqueued = 0
+        self._written = 0
+        self._rejected = 0
+        self._batches = 0
+        self._write_errors = 0
+        self._dead_lettered = 0
+        self._drain_last = 0.0
+        self._drain_max = 0.0
+        self._drain_total = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def put_many(self, rows):
+        """Queue all ``rows`` or none of them."""
+        if not rows:
+            return
+        if len(rows) > self.maxsize:
+            raise ValueError(f"Cannot queue {len(rows)} rows into a queue of size {self.maxsize}")
+        now = time.monotonic()
+        with self._cond:
+            if self._stopping:
+                raise IngestQueueFull("Ingest queue is shutting down")
+            if len(self._items) + len(rows) > self.maxsize:
+                if self.backpressure == 'block':
+                    self._cond.wait_for(lambda: len(self._items) + len(rows) <= self.maxsize or self._stopping,
+                                        timeout=self.block_timeout)
+                if self._stopping or len(self._items) + len(rows) > self.maxsize:
+                    self._rejected += len(rows)
+                    raise IngestQueueFull("Ingest queue is full")
+            self._items.extend((now, row) for row in rows)
+            self._enqueued += len(rows)
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until every queued row has been written. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._items and not self._in_flight, timeout=timeout)
+
+    def stop(self, timeout=10.0):
+        """Stop accepting rows, drain what is queued and stop the writer."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "mode": "queue",
+                "depth": len(self._items) + self._in_flight,
+                "capacity": self.maxsize,
+                "backpressure": self.backpressure,
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "rejected": self._rejected,
+                "batches": self._batches,
+                "write_errors": self._write_errors,
+                "dead_lettered": self._dead_lettered,
+                "drain_latency_ms": {
+                    "last": round(self._drain_last * 1000, 3),
+                    "max": round(self._drain_max * 1000, 3),
+                    "avg": round(self._drain_total / self._batches * 1000, 3) if self._batches else 0.0
+                }
+            }
+
+    def _take_batch(self):
+        with self._cond:
+            deadline = None
+            while True:
+                if len(self._items) >= self.batch_size or (self._stopping and self._items):
+                    break
+                if self._items:
+                    if deadline is None:
+                        deadline = self._items[0][0] + self.flush_interval
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                elif self._stopping:
+                    return None
+                else:
+                    self._cond.wait()
+            count = min(self.batch_size, len(self._items))
+            batch = [self._items.popleft() for _ in range(count)]
+            self._in_flight = count
+            self._cond.notify_all()
+            return batch
+
+    def _write(self, batch):
+        """Write ``batch``, bisecting around row errors.
+
+        Returns the number of rows written, the (entry, error) pairs that
+        failed on their own, and the entries left unwritten by an outage
+        together with its error.
+        """
+        written = 0
+        failed = []
+        pending = [batch]
+        while pending:
+            part = pending.pop()
+            try:
+                self.write_batch([row for _, row in part])
+                written += len(part)
+            except Exception as e:
+                if not self.is_row_error(e):
+                    unwritten = [entry for piece in [part] + pending[::-1] for entry in piece]
+                    return written, failed, unwritten, e
+                if len(part) == 1:
+                    failed.append((part[0], e))
+                else:
+                    middle = len(part) // 2
+                    pending.append(part[middle:])
+                    pending.append(part[:middle])
+        return written, failed, [], None
+
+    def _run(self):
+        failures = 0
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            written, failed, unwritten, error = self._write(batch)
+            for (_, row), e in failed:
+                print(f"Dead-lettering location row {row}: {str(e)}")
+            latency = time.monotonic() - batch[0][0]
+            with self._cond:
+                self._in_flight = 0
+                self._written += written
+                self._dead_lettered += len(failed)
+                if failed or unwritten:
+                    self._write_errors += 1
+                if written or failed:
+                    self._batches += 1
+                    self._drain_last = latency
+                    self._drain_max = max(self._drain_max, latency)
+                    self._drain_total += latency
+                if unwritten:
+                    self._items.extendleft(reversed(unwritten))
+                self._cond.notify_all()
+            if not unwritten:
+                failures = 0
+                continue
+            print(f"Ingest write error: {str(error)}")
+            failures += 1
+            if self._stopping and failures >= 3:
+                with self._cond:
+                    print(f"Dropping {len(self._items)} queued rows after repeated write errors on shutdown")
+                    self._items.clear()
+                    self._cond.notify_all()
+                return
+            time.sleep(min(self.flush_interval * 2 ** failures, 5.0))
@@ -0,0 +1,368 @@
+"""Load generator for the tracker API: simulated devices pinging through crowd relays.
+
+Usage:
+    python loadgen.py [--devices 1000] [--relays 10] [--latency lognormal:0.2:0.5] [--duration 30]
+    python loadgen.py --url http://127.0.0.1:5000 --devices 5000 --output results.json
+    python loadgen.py --output new.json --compare results.json
+    python loadgen.py --profile /update --profile-output update.prof
+
+Every device (tracker.Tracker) logs in once, then every --interval seconds
+sends an encrypted ping through a relay node (network.CrowdNetwork, one
+--latency spec per node in turn) to POST /update, and reads GET /latest every
+--latest-every pings. Logins are spread over --ramp-up seconds.
+
+Without --url the Flask app is served in-process from a --threads pool,
+against a throwaway SQLite file unless --database-url is given. With --url
+requests go over HTTP to a running server. Either way the loadgen-N users are
+created first, directly in DATABASE_URL, so point it at the server's database
+or pass --no-seed when they already exist.
+
+Reports requests/s and p50/p95/p99 latency per endpoint, as seen by the
+device, and the relay delays. --compare flags endpoints whose throughput or
+latency got worse than a saved run by more than --tolerance and exits 1.
+--profile runs cProfile around the in-process handling of the given endpoints
+(all of them when none are given). At most one request is profiled at a
+time, so the profile is a sample of the hot path.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from network import CrowdNetwork
+from tracker import Tracker
+
+ENDPOINTS = ['/login', '/update', '/latest']
+PASSWORD = 'loadgen-password'
+
+
+class HotPathProfiler:
+    def __init__(self, endpoints):
+        self.endpoints = set(endpoints or ENDPOINTS)
+        self.profile = cProfile.Profile()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, path):
+        if path not in self.endpoints or not self._lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            self.profile.enable()
+            try:
+                yield
+            finally:
+                self.profile.disable()
+            self.requests += 1
+        finally:
+            self._lock.release()
+
+    def summary(self, limit=25):
+        stats = pstats.Stats(self.profile)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return {
+            'endpoints': sorted(self.endpoints),
+            'profiled_requests': self.requests,
+            'top_cumulative': [{
+                'function': f"{os.path.join(*filename.split(os.sep)[-2:])}:{line}({name})",
+                'calls': calls,
+                'tottime_ms': round(tottime * 1000, 3),
+                'cumtime_ms': round(cumtime * 1000, 3)
+            } for (filename, line, name), (_, calls, tottime, cumtime, _) in functions]
+        }
+
+
+class InProcessTarget:
+    """Calls the Flask app through its test client on a thread pool."""
+
+    def __init__(self, app, threads, profiler=None):
+        self.app = app
+        self.profiler = profiler
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix='loadgen')
+        self._local = threading.local()
+
+    def _call(self, method, path, body, token):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        headers = {'Authorization': f"Bearer {token}"} if token else {}
+        with self.profiler.measure(path) if self.profiler else contextlib.nullcontext():
+            response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+    async def request(self, method, path, body=None, token=None):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, method, path, body, token)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class HttpTarget:
+    """Calls a running server with Tornado's non-blocking HTTP client."""
+
+    def __init__(self, base_url, connections, timeout):
+        from tornado.httpclient import AsyncHTTPClient
+        AsyncHTTPClient.configure(None, max_clients=connections)
+        self.client = AsyncHTTPClient()
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    async def request(self, method, path, body=None, token=None):
+        from tornado.httpclient import HTTPClientError
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        try:
+            response = await self.client.fetch(
+                self.base_url + path, method=method, headers=headers,
+                body=None if body is None else json.dumps(body),
+                request_timeout=self.timeout, raise_error=False)
+        except (HTTPClientError, OSError):
+            # Refused, reset or timed out; recorded as an error like Tornado's own 599
+            return 599, None
+        try:
+            payload = json.loads(response.body) if response.body else None
+        except ValueError:
+            payload = None
+        return response.code, payload
+
+    def close(self):
+        self.client.close()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+
+    async def timed(self, endpoint, call):
+        started = time.perf_counter()
+        status, payload = await call
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        self.statuses[endpoint][status] += 1
+        return status, payload
+
+
+def latency_summary(samples):
+    if not samples:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None, 'max_ms': None}
+    ms = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+        'max_ms': round(float(ms.max()), 3)
+    }
+
+
+def seed_users(app, db, bcrypt, User, devices, rounds):
+    """Create the loadgen-N users that do not exist yet, all with PASSWORD."""
+    password = bcrypt.generate_password_hash(PASSWORD, rounds).decode('utf-8')
+    emails = [f"loadgen-{i}@example.com" for i in range(devices)]
+    with app.app_context():
+        existing = {email for (email,) in db.session.execute(
+            db.select(User.email).where(User.email.like('loadgen-%@example.com')))}
+        rows = [{'email': email, 'device_id': f"loadgen-{i}", 'password': password, 'is_stolen': False}
+                for i, email in enumerate(emails) if email not in existing]
+        if rows:
+            db.session.execute(db.insert(User), rows)
+            db.session.commit()
+    return len(rows)
+
+
+async def run_device(index, target, network, recorder, args, deadline):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed * 1000003 + index)
+    tracker = Tracker(f"loadgen-{index}", rng=rng)
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    status, payload = await recorder.timed('/login', target.request(
+        'POST', '/login', {'email': f"loadgen-{index}@example.com", 'password': PASSWORD}))
+    if status != 200 or not payload:
+        return
+    token = payload['token']
+
+    sent = 0
+    next_ping = loop.time() + rng.uniform(0, args.interval)
+    while True:
+        await asyncio.sleep(max(0.0, next_ping - loop.time()))
+        if loop.time() >= deadline:
+            return
+        next_ping += args.interval
+        relay_started = time.perf_counter()
+        encrypted_data = await network.relay_signal(tracker.device_id, tracker.ping())
+        recorder.latencies['relay'].append(time.perf_counter() - relay_started)
+        await recorder.timed('/update', target.request('POST', '/update', {'data': encrypted_data}, token))
+        sent += 1
+        if args.latest_every and sent % args.latest_every == 0:
+            await recorder.timed('/latest', target.request('GET', '/latest', token=token))
+
+
+async def generate_load(target, args):
+    network = CrowdNetwork(args.relays, args.latency, rng=random.Random(args.seed), verbose=False)
+    recorder = Recorder()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + args.duration
+    await asyncio.gather(*(
+        run_device(i, target, network, recorder, args, deadline) for i in range(args.devices)))
+    return recorder, loop.time() - started
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        statuses = recorder.statuses[endpoint]
+        count = sum(statuses.values())
+        endpoints[endpoint] = {
+            'requests': count,
+            'errors': sum(n for status, n in statuses.items() if not 200 <= status < 300),
+            'statuses': {str(status): n for status, n in sorted(statuses.items())},
+            'throughput_per_s': round(count / elapsed, 1) if elapsed else 0.0,
+            **latency_summary(recorder.latencies[endpoint])
+        }
+    return endpoints
+
+
+def compare(results, baseline, tolerance):
+    """Per-endpoint changes against a baseline run; lower throughput or higher
+    latency by more than ``tolerance`` (a fraction) counts as a regression."""
+    changes = []
+    for endpoint in ENDPOINTS:
+        current, previous = results['endpoints'].get(endpoint), baseline.get('endpoints', {}).get(endpoint)
+        if not current or not previous:
+            continue
+        for metric in ('throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms'):
+            new, old = current.get(metric), previous.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            worse = -change if metric == 'throughput_per_s' else change
+            changes.append({
+                'endpoint': endpoint,
+                'metric': metric,
+                'baseline': old,
+                'current': new,
+                'change_pct': round(change * 100, 1),
+                'regression': worse > tolerance
+            })
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--relays', type=int, default=10)
+    parser.add_argument('--latency', nargs='+', default=['lognormal:0.2:0.5'],
+                        help='relay delay specs in seconds: const:S uniform:LOW:HIGH normal:MEAN:STDDEV '
+                             'lognormal:MEDIAN:SIGMA exp:MEAN')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between a device\'s pings')
+    parser.add_argument('--latest-every', type=int, default=5, help='GET /latest every this many pings (0 = never)')
+    parser.add_argument('--ramp-up', type=float, default=10.0, help='seconds over which devices log in')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='base URL of a running server; in-process when omitted')
+    parser.add_argument('--connections', type=int, default=100, help='concurrent HTTP connections with --url')
+    parser.add_argument('--timeout', type=float, default=60.0, help='HTTP request timeout with --url')
+    parser.add_argument('--threads', type=int, default=8, help='in-process worker threads')
+    parser.add_argument('--database-url', help='DATABASE_URL to seed users in (and serve from, in-process)')
+    parser.add_argument('--no-seed', action='store_true', help='the loadgen-N users already exist')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='cost of the seeded password hashes')
+    parser.add_argument('--profile', nargs='*', metavar='ENDPOINT', help='profile in-process endpoints')
+    parser.add_argument('--profile-output', help='write the raw cProfile stats here, for pstats or snakeviz')
+    parser.add_argument('--output', help='write the results JSON here')
+    parser.add_argument('--compare', metavar='BASELINE', help='results JSON of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed fractional regression')
+    args = parser.parse_args()
+
+    if args.profile is not None and args.url:
+        parser.error('--profile needs the in-process target')
+    for endpoint in args.profile or []:
+        if endpoint not in ENDPOINTS:
+            parser.error(f"--profile endpoints must be among {', '.join(ENDPOINTS)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.database_url:
+            os.environ['DATABASE_URL'] = args.database_url
+        elif not args.url:
+            os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'loadgen.db')}"
+        from app import app, bcrypt, db, ingest_queue, init_db, User
+
+        with app.app_context():
+            init_db()
+            database = db.engine.dialect.name
+        seeded = 0 if args.no_seed else seed_users(app, db, bcrypt, User, args.devices, args.bcrypt_rounds)
+
+        profiler = HotPathProfiler(args.profile) if args.profile is not None else None
+
+        async def run():
+            target = (HttpTarget(args.url, args.connections, args.timeout) if args.url
+                      else InProcessTarget(app, args.threads, profiler))
+            try:
+                return await generate_load(target, args)
+            finally:
+                target.close()
+
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        # The routes print every ping; keep that out of the report
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            recorder, elapsed = asyncio.run(run())
+            if ingest_queue and not args.url:
+                ingest_queue.stop()
+
+    results = {
+        'target': args.url or 'in-process',
+        'database': database,
+        'started_at': started_at.isoformat(),
+        'elapsed_s': round(elapsed, 3),
+        'config': {
+            'devices': args.devices,
+            'relays': args.relays,
+            'latency': args.latency,
+            'duration': args.duration,
+            'interval': args.interval,
+            'latest_every': args.latest_every,
+            'ramp_up': args.ramp_up,
+            'threads': None if args.url else args.threads,
+            'connections': args.connections if args.url else None,
+            'bcrypt_rounds': args.bcrypt_rounds,
+            'seeded_users': seeded
+        },
+        'endpoints': summarize(recorder, elapsed),
+        'relay': latency_summary(recorder.latencies['relay'])
+    }
+    if profiler:
+        results['profile'] = profiler.summary()
+        if args.profile_output:
+            profiler.profile.dump_stats(args.profile_output)
+
+    regressions = False
+    if args.compare:
+        with open(args.compare) as f:
+            results['comparison'] = compare(results, json.load(f), args.tolerance)
+        regressions = any(change['regression'] for change in results['comparison'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
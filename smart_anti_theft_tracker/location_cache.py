@@ -0,0 +1,62 @@
+import threading
+import time
+
+
+class LatestLocationCache:
+    """Per-device latest-fix cache backend.
+
+    A fix is the row mapping produced by ``parse_ping``: ``device_id``,
+    ``latitude``, ``longitude``, ``timestamp`` (naive UTC) and ``is_theft``.
+    Backends only have to implement ``get`` and ``offer``; a shared store
+    can replace the in-process one when several workers serve ``/latest``.
+    """
+
+    def get(self, device_id):
+        """Return the cached fix for ``device_id`` or None."""
+        raise NotImplementedError
+
+    def offer(self, fix):
+        """Store ``fix`` unless a newer one is already cached. Returns True if stored."""
+        raise NotImplementedError
+
+    def metrics(self):
+        return {}
+
+
+class InMemoryLatestLocationCache(LatestLocationCache):
+    """Process-local cache. ``ttl`` (seconds, 0 = never) bounds how long a
+    fix is served before the caller falls back to the database, which keeps
+    workers that do not see every ping from serving a stale fix forever."""
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._fixes = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, device_id):
+        entry = self._fixes.get(device_id)
+        if entry is not None and (not self.ttl or time.monotonic() - entry[0] < self.ttl):
+            self._hits += 1
+            return dict(entry[1])
+        self._misses += 1
+        return None
+
+    def offer(self, fix):
+        device_id = fix['device_id']
+        with self._lock:
+            entry = self._fixes.get(device_id)
+            if entry is not None and entry[1]['timestamp'] > fix['timestamp']:
+                if not self.ttl or time.monotonic() - entry[0] < self.ttl:
+                    return False
+            self._fixes[device_id] = (time.monotonic(), dict(fix))
+            return True
+
+    def metrics(self):
+        return {
+            "backend": "memory",
+            "devices": len(self._fixes),
+            "hits": self._hits,
+            "misses": self._misses
+        }
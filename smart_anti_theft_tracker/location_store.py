@@ -0,0 +1,496 @@
+"""Storage layer for location fixes.
+
+``TableLocationStore`` keeps raw fixes in the single ``location`` table.
+``PartitionedLocationStore`` spreads them over one table per day, week or
+month, so inserts and newest-fix lookups only touch the current period's
+small table and expired periods are dropped whole. On PostgreSQL the period
+tables are native partitions of ``location_raw``; on SQLite they are plain
+tables.
+
+Both stores apply the same retention policy in ``maintain``: raw fixes older
+than ``raw_retention`` are rolled up into ``location_rollup`` as the last
+fix per ``rollup_bucket`` seconds. ``is_theft`` fixes are kept at full
+resolution, and rollups older than ``rollup_retention`` are deleted, except
+theft fixes. Rows older than the rolled-up boundary go straight to the rollup
+table, so raw and rolled-up history never overlap. The boundary lives in the
+``location_store_state`` table so that every worker process agrees on it; each
+one reloads it, and its list of partitions, every ``refresh_interval`` seconds.
+"""
+import datetime
+import threading
+import time
+
+import sqlalchemy as sa
+
+PERIODS = ('day', 'week', 'month')
+RAW_PARENT = 'location_raw'
+# pg_advisory_xact_lock key held while maintenance runs
+MAINTENANCE_LOCK_ID = 0x6c6f6361
+
+STATE = sa.Table(
+    'location_store_state', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('rolled_before', sa.DateTime))
+
+
+def period_start(timestamp, period):
+    if period == 'day':
+        return datetime.datetime(timestamp.year, timestamp.month, timestamp.day)
+    if period == 'week':
+        day = datetime.datetime(timestamp.year, timestamp.month, timestamp.day)
+        return day - datetime.timedelta(days=day.weekday())
+    return datetime.datetime(timestamp.year, timestamp.month, 1)
+
+
+def period_end(start, period):
+    if period == 'day':
+        return start + datetime.timedelta(days=1)
+    if period == 'week':
+        return start + datetime.timedelta(days=7)
+    return datetime.datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def not_theft(column):
+    return sa.func.coalesce(column, sa.false()) == sa.false()
+
+
+class LocationStore:
+    def __init__(self, rollup_table, raw_retention=None, rollup_bucket=60, rollup_retention=None,
+                 refresh_interval=60):
+        self.rollup = rollup_table
+        self.raw_retention = raw_retention
+        self.rollup_bucket = rollup_bucket
+        self.rollup_retention = rollup_retention
+        self.refresh_interval = refresh_interval
+        self.rolled_before = None
+        self.last_maintenance = None
+        self._lock = threading.Lock()
+        self._prepared = False
+        self._refreshed = 0.0
+
+    # Backend hooks
+
+    def _raw_tables(self, bind, start=None, end=None):
+        """``(table, lower, upper)`` for every raw table overlapping the window, oldest first."""
+        raise NotImplementedError
+
+    def _route(self, bind, rows):
+        """Group rows by the table they go to, creating tables as needed.
+
+        Called before anything is written in the caller's transaction, as
+        SQLite cannot run DDL on another connection once that holds a write lock.
+        """
+        raise NotImplementedError
+
+    def _expire_raw(self, connection, cutoff):
+        """Roll up and remove raw fixes older than ``cutoff``; return the new boundary and stats."""
+        raise NotImplementedError
+
+    def _boundary_after(self, timestamp):
+        raise NotImplementedError
+
+    def _load(self, bind):
+        """Create backend tables if needed."""
+
+    def _refresh(self, bind):
+        """Reload backend tables other processes may have created or dropped."""
+
+    def _needs_tables(self, rows):
+        """Whether inserting ``rows`` would create tables."""
+        return False
+
+    # Shared behaviour
+
+    def prepare(self, bind):
+        """Create the store's tables if needed and load its state."""
+        self.rollup.create(bind, checkfirst=True)
+        STATE.create(bind, checkfirst=True)
+        try:
+            with bind.begin() as connection:
+                if connection.execute(sa.select(STATE.c.id)).first() is None:
+                    # First run, or a database from before the state table: derive it from the rollups
+                    newest = connection.execute(sa.select(sa.func.max(self.rollup.c.timestamp))).scalar()
+                    connection.execute(sa.insert(STATE).values(
+                        id=1, rolled_before=self._boundary_after(newest) if newest is not None else None))
+        except sa.exc.IntegrityError:
+            pass  # Another worker inserted it first
+        self._load(bind)
+        self._reload(bind)
+        self._prepared = True
+
+    def _reload(self, bind, tables=True):
+        """Load the rolled-up boundary from the database, and the backend's
+        tables too when asked to or when the boundary moved."""
+        if isinstance(bind, sa.engine.Connection):
+            boundary = bind.execute(sa.select(STATE.c.rolled_before)).scalar()
+        else:
+            with bind.connect() as connection:
+                boundary = connection.execute(sa.select(STATE.c.rolled_before)).scalar()
+        if tables or boundary != self.rolled_before:
+            self._refresh(bind)
+        with self._lock:
+            self.rolled_before = boundary
+            if tables:
+                self._refreshed = time.monotonic()
+
+    def _ensure_current(self, bind):
+        if not self._prepared:
+            with self._lock:
+                if not self._prepared:
+                    self.prepare(bind)
+        if time.monotonic() - self._refreshed > self.refresh_interval:
+            self._reload(bind)
+
+    def insert_many(self, session, rows):
+        """Insert row mappings in the caller's transaction; the caller commits."""
+        bind = session.get_bind()
+        self._ensure_current(bind)
+        expiring = False
+        if self.raw_retention is not None:
+            oldest_raw = datetime.datetime.utcnow() - self.raw_retention
+            expiring = any(row['timestamp'] < oldest_raw for row in rows)
+        if expiring or self._needs_tables(rows):
+            # Another worker may have opened a new period or rolled old ones up
+            self._reload(bind)
+        boundary = self.rolled_before
+        late = []
+        if boundary is not None:
+            late = [dict(row, samples=1) for row in rows if row['timestamp'] < boundary]
+            if late:
+                rows = [row for row in rows if row['timestamp'] >= boundary]
+        for table, group in self._route(bind, rows):
+            session.execute(sa.insert(table), group)
+        if late:
+            session.execute(sa.insert(self.rollup), late)
+
+    def _columns(self, table):
+        return (table.c.id, table.c.timestamp, table.c.latitude, table.c.longitude, table.c.is_theft)
+
+    def latest(self, session, device_id):
+        """Newest fix for ``device_id`` as a row mapping, or None."""
+        bind = session.get_bind()
+        self._ensure_current(bind)
+        for table, _, _ in list(reversed(self._raw_tables(bind))) + [(self.rollup, None, None)]:
+            row = session.execute(
+                sa.select(*self._columns(table))
+                .where(table.c.device_id == device_id)
+                .order_by(table.c.timestamp.desc())
+                .limit(1)
+            ).first()
+            if row is not None:
+                return {
+                    'device_id': device_id,
+                    'latitude': row.latitude,
+                    'longitude': row.longitude,
+                    'timestamp': row.timestamp,
+                    'is_theft': bool(row.is_theft)
+                }
+        return None
+
+    def _sources(self, bind, start, end):
+        """Tables holding fixes in ``[start, end)``, oldest first, each with its row filter."""
+        # Maintenance in another worker may have moved the boundary since the last refresh
+        self._reload(bind, tables=False)
+        sources = []
+        if self.rolled_before is not None and start < self.rolled_before:
+            sources.append((self.rollup, self.rollup.c.timestamp < self.rolled_before))
+        sources.extend((table, sa.true()) for table, _, _ in self._raw_tables(bind, start, end))
+        return sources
+
+    def history(self, session, device_id, start, end, cursor=None, limit=1000):
+        """Up to ``limit`` rows in ``[start, end)`` after the ``(timestamp, id)``
+        cursor, oldest first. Rolled-up fixes come before raw ones."""
+        bind = session.get_bind()
+        self._ensure_current(bind)
+        rows = []
+        for table, condition in self._sources(bind, start, end):
+            query = sa.select(*self._columns(table)).where(
+                condition,
+                table.c.device_id == device_id,
+                table.c.timestamp >= start,
+                table.c.timestamp < end)
+            if cursor is not None:
+                query = query.where(sa.or_(
+                    table.c.timestamp > cursor[0],
+                    sa.and_(table.c.timestamp == cursor[0], table.c.id > cursor[1])))
+            rows.extend(session.execute(
+                query.order_by(table.c.timestamp, table.c.id).limit(limit - len(rows))
+            ).all())
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def recent(self, session, device_id, start, end, limit):
+        """The newest ``limit`` rows in ``[start, end)``, oldest first."""
+        bind = session.get_bind()
+        self._ensure_current(bind)
+        rows = []
+        for table, condition in reversed(self._sources(bind, start, end)):
+            rows.extend(session.execute(
+                sa.select(*self._columns(table))
+                .where(condition, table.c.device_id == device_id,
+                       table.c.timestamp >= start, table.c.timestamp < end)
+                .order_by(table.c.timestamp.desc(), table.c.id.desc())
+                .limit(limit - len(rows))
+            ).all())
+            if len(rows) >= limit:
+                break
+        return rows[::-1]
+
+    def sample(self, session, device_id, start, end, size):
+        """About ``size`` rows spread evenly over ``[start, end)``, oldest first:
+        every n-th fix, with n chosen from the window's row count."""
+        bind = session.get_bind()
+        self._ensure_current(bind)
+        sources = []
+        for table, condition in self._sources(bind, start, end):
+            condition = sa.and_(condition, table.c.device_id == device_id,
+                                table.c.timestamp >= start, table.c.timestamp < end)
+            sources.append((table, condition, session.execute(
+                sa.select(sa.func.count()).select_from(table).where(condition)).scalar()))
+        step = max(1, -(-sum(count for _, _, count in sources) // size))
+        rows = []
+        for table, condition, count in sources:
+            if not count:
+                continue
+            ranked = sa.select(
+                *self._columns(table),
+                sa.func.row_number().over(order_by=(table.c.timestamp, table.c.id)).label('rn')
+            ).where(condition).subquery()
+            rows.extend(session.execute(
+                sa.select(ranked.c.id, ranked.c.timestamp, ranked.c.latitude, ranked.c.longitude,
+                          ranked.c.is_theft)
+                .where((ranked.c.rn - 1) % step == 0)
+                .order_by(ranked.c.timestamp, ranked.c.id)
+            ).all())
+        return rows
+
+    def _rollup_bucket_expr(self, connection, column):
+        if connection.dialect.name == 'postgresql':
+            return sa.func.floor(sa.extract('epoch', column) / self.rollup_bucket)
+        return sa.cast(sa.func.strftime('%s', column), sa.Integer) // int(self.rollup_bucket)
+
+    def _roll_up(self, connection, table, condition):
+        """Copy the last fix per device and bucket, plus every theft fix, into the rollup table."""
+        bucket = self._rollup_bucket_expr(connection, table.c.timestamp)
+        window = (table.c.device_id, bucket)
+        ranked = sa.select(
+            table.c.device_id, table.c.timestamp, table.c.latitude, table.c.longitude, table.c.is_theft,
+            sa.func.row_number().over(
+                partition_by=window, order_by=(table.c.timestamp.desc(), table.c.id.desc())).label('rn'),
+            sa.func.count().over(partition_by=window).label('samples')
+        ).where(condition, not_theft(table.c.is_theft)).subquery()
+        summaries = sa.select(
+            ranked.c.device_id, ranked.c.timestamp, ranked.c.latitude, ranked.c.longitude,
+            ranked.c.is_theft, ranked.c.samples
+        ).where(ranked.c.rn == 1)
+        thefts = sa.select(
+            table.c.device_id, table.c.timestamp, table.c.latitude, table.c.longitude,
+            table.c.is_theft, sa.literal(1)
+        ).where(condition, sa.not_(not_theft(table.c.is_theft)))
+        result = connection.execute(sa.insert(self.rollup).from_select(
+            ['device_id', 'timestamp', 'latitude', 'longitude', 'is_theft', 'samples'],
+            sa.union_all(summaries, thefts)))
+        return result.rowcount
+
+    def maintain(self, bind, now=None):
+        """Apply the retention policy once and return what was done.
+
+        Every worker process runs this, so it first takes a lock held for the
+        whole transaction (an advisory lock on PostgreSQL, the database write
+        lock elsewhere) and reloads the store's state once it has it; a second
+        worker then only sees what the first left behind. The new boundary is
+        saved in the same transaction.
+        """
+        self._ensure_current(bind)
+        now = now or datetime.datetime.utcnow()
+        started = time.perf_counter()
+        stats = {"rolled_up": 0, "rollups_deleted": 0}
+        with bind.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(sa.text("SELECT pg_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_ID})
+            else:
+                # A write up front, so SQLite takes its write lock now
+                connection.execute(sa.update(STATE).values(rolled_before=STATE.c.rolled_before))
+            self._reload(connection)
+            if self.raw_retention is not None:
+                boundary, expired = self._expire_raw(connection, now - self.raw_retention)
+                stats.update(expired)
+                if boundary is not None and (self.rolled_before is None or boundary > self.rolled_before):
+                    connection.execute(sa.update(STATE).values(rolled_before=boundary))
+                    self.rolled_before = boundary
+            if self.rollup_retention is not None:
+                stats["rollups_deleted"] = connection.execute(sa.delete(self.rollup).where(
+                    self.rollup.c.timestamp < now - self.rollup_retention,
+                    not_theft(self.rollup.c.is_theft))).rowcount
+        stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        stats["ran_at"] = now.isoformat() + "Z"
+        self.last_maintenance = stats
+        return stats
+
+    def metrics(self):
+        return {
+            "rolled_before": self.rolled_before.isoformat() + "Z" if self.rolled_before else None,
+            "last_maintenance": self.last_maintenance
+        }
+
+
+class TableLocationStore(LocationStore):
+    """Raw fixes in one table (the ``Location`` model)."""
+
+    def __init__(self, table, rollup_table, **kwargs):
+        super().__init__(rollup_table, **kwargs)
+        self.table = table
+
+    def _raw_tables(self, bind, start=None, end=None):
+        return [(self.table, None, None)]
+
+    def _route(self, bind, rows):
+        return [(self.table, rows)] if rows else []
+
+    def _boundary_after(self, timestamp):
+        return timestamp + datetime.timedelta(microseconds=1)
+
+    def _expire_raw(self, connection, cutoff):
+        if self.rolled_before is not None and cutoff <= self.rolled_before:
+            return None, {}
+        condition = self.table.c.timestamp < cutoff
+        rolled_up = self._roll_up(connection, self.table, condition)
+        deleted = connection.execute(sa.delete(self.table).where(condition)).rowcount
+        return cutoff, {"rolled_up": rolled_up, "raw_deleted": deleted}
+
+    def metrics(self):
+        return {"mode": "table", **super().metrics()}
+
+
+class PartitionedLocationStore(LocationStore):
+    """Raw fixes in one table per ``period`` (day, week or month)."""
+
+    def __init__(self, rollup_table, period='month', **kwargs):
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {PERIODS}, got {period!r}")
+        super().__init__(rollup_table, **kwargs)
+        self.period = period
+        self.metadata = sa.MetaData()
+        self._partitions = {}
+
+    def partition_name(self, start):
+        return f"{RAW_PARENT}_{self.period}_{start:%Y%m%d}"
+
+    def _parse_name(self, name):
+        try:
+            _, _, period, day = name.rsplit('_', 3)
+            start = datetime.datetime.strptime(day, '%Y%m%d')
+        except ValueError:
+            return None
+        if period not in PERIODS:
+            return None
+        return start, period_end(start, period)
+
+    def _table(self, name, postgresql=False, **kwargs):
+        if name in self.metadata.tables:
+            return self.metadata.tables[name]
+        if postgresql:
+            # Partitions need the partition key in the primary key
+            key = [sa.Column('id', sa.BigInteger, primary_key=True, autoincrement=True),
+                   sa.Column('timestamp', sa.DateTime, primary_key=True)]
+        else:
+            key = [sa.Column('id', sa.Integer, primary_key=True),
+                   sa.Column('timestamp', sa.DateTime, nullable=False)]
+        table = sa.Table(
+            name, self.metadata, *key,
+            sa.Column('device_id', sa.String(50), nullable=False),
+            sa.Column('latitude', sa.Float, nullable=False),
+            sa.Column('longitude', sa.Float, nullable=False),
+            sa.Column('is_theft', sa.Boolean, default=False),
+            **kwargs)
+        if not postgresql or name == RAW_PARENT:
+            sa.Index(f"ix_{name}_device_id_timestamp", table.c.device_id, table.c.timestamp)
+        return table
+
+    def _load(self, bind):
+        if bind.dialect.name == 'postgresql':
+            self._table(RAW_PARENT, postgresql=True, postgresql_partition_by='RANGE (timestamp)') \
+                .create(bind, checkfirst=True)
+
+    def _refresh(self, bind):
+        partitions = {}
+        postgresql = bind.dialect.name == 'postgresql'
+        for name in sa.inspect(bind).get_table_names():
+            if name.startswith(RAW_PARENT + '_'):
+                bounds = self._parse_name(name)
+                if bounds is not None:
+                    partitions[name] = (self._table(name, postgresql), *bounds)
+        with self._lock:
+            self._partitions = partitions
+
+    def _needs_tables(self, rows):
+        starts = {period_start(row['timestamp'], self.period) for row in rows}
+        with self._lock:
+            return any(self.partition_name(start) not in self._partitions for start in starts)
+
+    def _raw_tables(self, bind, start=None, end=None):
+        current = self.partition_name(period_start(datetime.datetime.utcnow(), self.period))
+        with self._lock:
+            missing = current not in self._partitions
+        if missing and time.monotonic() - self._refreshed > 1.0:
+            # Another worker may have opened the new period already
+            self._reload(bind)
+        with self._lock:
+            partitions = sorted(self._partitions.values(), key=lambda p: p[1])
+        return [p for p in partitions
+                if (start is None or p[2] > start) and (end is None or p[1] < end)]
+
+    def _ensure_partition(self, bind, start):
+        name = self.partition_name(start)
+        with self._lock:
+            if name in self._partitions:
+                return self._partitions[name][0]
+        end = period_end(start, self.period)
+        postgresql = bind.dialect.name == 'postgresql'
+        table = self._table(name, postgresql)
+        # Own transaction, so a rolled back insert does not take the partition with it
+        with bind.begin() as connection:
+            if postgresql:
+                connection.execute(sa.text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {RAW_PARENT} "
+                    f"FOR VALUES FROM ('{start.isoformat(' ')}') TO ('{end.isoformat(' ')}')"))
+            else:
+                table.create(connection, checkfirst=True)
+        with self._lock:
+            self._partitions[name] = (table, start, end)
+        return table
+
+    def _route(self, bind, rows):
+        groups = {}
+        for row in rows:
+            groups.setdefault(period_start(row['timestamp'], self.period), []).append(row)
+        routed = [(self._ensure_partition(bind, start), group) for start, group in groups.items()]
+        if bind.dialect.name == 'postgresql':
+            # The parent routes rows and assigns ids from its sequence
+            return [(self.metadata.tables[RAW_PARENT], rows)] if rows else []
+        return routed
+
+    def _boundary_after(self, timestamp):
+        return period_end(period_start(timestamp, self.period), self.period)
+
+    def _expire_raw(self, connection, cutoff):
+        boundary = None
+        dropped = 0
+        rolled_up = 0
+        for table, start, end in self._raw_tables(connection):
+            if end > cutoff:
+                break
+            rolled_up += self._roll_up(connection, table, sa.true())
+            connection.execute(sa.text(f"DROP TABLE {table.name}"))
+            with self._lock:
+                self._partitions.pop(table.name, None)
+            self.metadata.remove(table)
+            boundary = end
+            dropped += 1
+        return boundary, {"rolled_up": rolled_up, "partitions_dropped": dropped}
+
+    def metrics(self):
+        with self._lock:
+            partitions = len(self._partitions)
+        return {"mode": "partitioned", "period": self.period, "partitions": partitions, **super().metrics()}
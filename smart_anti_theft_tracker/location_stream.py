@@ -0,0 +1,102 @@
+import asyncio
+import collections
+import threading
+
+
+class Subscription:
+    """One viewer's stream of fixes for a device.
+
+    Lives on an asyncio loop. Normal fixes are coalesced so a slow viewer
+    only ever gets the newest one; ``is_theft`` fixes are queued separately,
+    never coalesced and always delivered first.
+    """
+
+    def __init__(self, broker, device_id, loop, max_theft=100):
+        self.broker = broker
+        self.device_id = device_id
+        self.loop = loop
+        self._event = asyncio.Event()
+        self._latest = None
+        self._theft = collections.deque(maxlen=max_theft)
+
+    def _push(self, fix):
+        if fix['is_theft']:
+            self._theft.append(fix)
+        else:
+            self._latest = fix
+        self._event.set()
+
+    async def next(self, timeout=None):
+        """Return the next fix, or None if ``timeout`` seconds pass without one."""
+        if not self._theft and self._latest is None:
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self._theft:
+            return self._theft.popleft()
+        fix, self._latest = self._latest, None
+        return fix
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocationBroker:
+    """Fans accepted fixes out to stream subscribers.
+
+    ``publish`` may be called from any thread (Flask request handlers, the
+    ingest writer). It schedules one callback per subscriber loop rather than
+    per subscriber, so the cost on the ingest path does not grow with the
+    number of idle viewers.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, device_id, loop=None):
+        subscription = Subscription(self, device_id, loop or asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(device_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.device_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.device_id]
+
+    def publish(self, fix):
+        with self._lock:
+            subscribers = self._subscribers.get(fix['device_id'])
+            if not subscribers:
+                return
+            by_loop = {}
+            for subscription in subscribers:
+                by_loop.setdefault(subscription.loop, []).append(subscription)
+        fix = dict(fix)
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._fanout, subscriptions, fix)
+            except RuntimeError:
+                # Loop already closed; its subscriptions go away with it
+                pass
+
+    @staticmethod
+    def _fanout(subscriptions, fix):
+        for subscription in subscriptions:
+            subscription._push(fix)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "devices": len(self._subscribers),
+                "subscribers": sum(len(s) for s in self._subscribers.values())
+            }
+
+
+location_broker = LocationBroker()
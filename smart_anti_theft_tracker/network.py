@@ -1,15 +1,47 @@
 import random
 import asyncio
 
+def latency_sampler(spec: str):
+    """Turn a latency spec into a function of an RNG returning seconds.
+
+    Specs, in seconds: ``const:S``, ``uniform:LOW:HIGH``, ``normal:MEAN:STDDEV``,
+    ``lognormal:MEDIAN:SIGMA`` and ``exp:MEAN``. Negative draws are clamped to 0.
+    """
+    kind, *params = spec.split(':')
+    try:
+        params = [float(p) for p in params]
+        draw = {
+            'const': lambda rng, s: s,
+            'uniform': lambda rng, low, high: rng.uniform(low, high),
+            'normal': lambda rng, mean, stddev: rng.gauss(mean, stddev),
+            'lognormal': lambda rng, median, sigma: median * rng.lognormvariate(0.0, sigma),
+            'exp': lambda rng, mean: rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+        }[kind]
+        draw(random.Random(0), *params)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid latency spec: {spec}")
+    return lambda rng: max(0.0, draw(rng, *params))
+
 class CrowdNetwork:
-    def __init__(self):
-        self.nodes = ["node_1", "node_2", "node_3"]
+    def __init__(self, nodes=None, latency='const:1', rng: random.Random = None, verbose: bool = True):
+        """``nodes`` is a list of node names or a node count. ``latency`` is one
+        spec for every node or a list of specs handed out to nodes in turn."""
+        if nodes is None:
+            nodes = ["node_1", "node_2", "node_3"]
+        elif isinstance(nodes, int):
+            nodes = [f"node_{i + 1}" for i in range(nodes)]
+        specs = [latency] if isinstance(latency, str) else list(latency)
+        self.nodes = nodes
+        self.latency = {node: latency_sampler(specs[i % len(specs)]) for i, node in enumerate(nodes)}
+        self.rng = rng or random.Random()
+        self.verbose = verbose
 
     async def relay_signal(self, device_id: str, encrypted_data: str) -> str:
         """Simulate a node relaying the signal."""
-        relay_node = random.choice(self.nodes)
-        print(f"{relay_node} relayed {device_id}: {encrypted_data}")
-        await asyncio.sleep(1)  # Simulate network delay
+        relay_node = self.rng.choice(self.nodes)
+        if self.verbose:
+            print(f"{relay_node} relayed {device_id}: {encrypted_data}")
+        await asyncio.sleep(self.latency[relay_node](self.rng))  # Simulate network delay
         return encrypted_data
 
 network = CrowdNetwork()
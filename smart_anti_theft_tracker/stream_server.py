@@ -0,0 +1,116 @@
+"""Serve the Flask app plus a Server-Sent Events location stream from one process.
+
+    python stream_server.py [--port 5000] [--threads 16]
+
+GET /stream authenticates once with the same bearer token as the REST API
+(``Authorization: Bearer <token>``, or ``?token=<token>`` for EventSource
+clients that cannot set headers) and then pushes every new fix for the
+caller's device as soon as ``receive_update`` accepts it. Theft fixes are
+sent as ``event: theft`` ahead of any pending normal fix. Idle viewers cost
+one coroutine on the asyncio loop; every other route is handed to Flask on a
+thread pool.
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+import tornado.iostream
+import tornado.web
+import tornado.wsgi
+
+import app as app_module
+from app import app, authenticate, init_db, serialize_fix
+from location_stream import location_broker
+
+HEARTBEAT_INTERVAL = 15
+
+
+class StreamHandler(tornado.web.RequestHandler):
+    def initialize(self, executor):
+        self.executor = executor
+        self.subscription = None
+
+    def _authenticate(self, token):
+        with app.app_context():
+            device_id = authenticate(token).device_id
+        expires = jwt.decode(token, options={"verify_signature": False}).get('exp')
+        return device_id, expires
+
+    def _error(self, status_code, message):
+        self.set_status(status_code)
+        self.finish({"status": "error", "message": message})
+
+    async def _send(self, fix):
+        event = 'theft' if fix['is_theft'] else 'fix'
+        self.write(f"event: {event}\ndata: {json.dumps(serialize_fix(fix))}\n\n")
+        await self.flush()
+
+    async def get(self):
+        header = self.request.headers.get('Authorization', '')
+        token = header.split(" ")[1] if header.startswith('Bearer ') else self.get_query_argument('token', None)
+        if not token:
+            return self._error(401, "Token is missing")
+        try:
+            device_id, expires = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._authenticate, token)
+        except Exception as e:
+            return self._error(401, f"Token is invalid: {str(e)}")
+
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Accel-Buffering', 'no')
+        self.subscription = location_broker.subscribe(device_id)
+        try:
+            latest = app_module.latest_cache.get(device_id)
+            if latest:
+                await self._send(latest)
+            else:
+                self.write(": connected\n\n")
+                await self.flush()
+            while expires is None or time.time() < expires:
+                timeout = HEARTBEAT_INTERVAL if expires is None else min(HEARTBEAT_INTERVAL, expires - time.time())
+                fix = await self.subscription.next(max(timeout, 0))
+                if fix is None:
+                    self.write(": keepalive\n\n")
+                    await self.flush()
+                else:
+                    await self._send(fix)
+            self.write("event: expired\ndata: {}\n\n")
+        except tornado.iostream.StreamClosedError:
+            return
+        finally:
+            self.subscription.close()
+
+    def on_connection_close(self):
+        # Stop fanning out to this viewer now; the handler exits on its next write
+        if self.subscription is not None:
+            self.subscription.close()
+
+
+def make_app(threads=16):
+    executor = ThreadPoolExecutor(threads)
+    wsgi_app = tornado.wsgi.WSGIContainer(app, executor=executor)
+    return tornado.web.Application([
+        (r'/stream', StreamHandler, {'executor': executor}),
+        (r'.*', tornado.web.FallbackHandler, {'fallback': wsgi_app}),
+    ])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    with app.app_context():
+        init_db()
+    make_app(args.threads).listen(args.port, address=args.host)
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+import unittest
+
+from ingest_queue import IngestQueue
+
+
+class DatabaseDown(Exception):
+    pass
+
+
+class BadRow(ValueError):
+    pass
+
+
+class IngestQueueWriteErrorTest(unittest.TestCase):
+    def make_queue(self, write_batch):
+        queue = IngestQueue(write_batch, maxsize=1000, batch_size=8, flush_interval=0.01).start()
+        self.addCleanup(queue.stop)
+        return queue
+
+    def test_outage_during_bisection_loses_no_rows(self):
+        written = []
+        calls = []
+
+        def write_batch(rows):
+            calls.append(list(rows))
+            if len(calls) == 1:
+                raise BadRow("row 7 is bad")
+            if len(calls) <= 5:
+                raise DatabaseDown("connection refused")
+            written.extend(rows)
+
+        queue = self.make_queue(write_batch)
+        queue.put_many(list(range(8)))
+        self.assertTrue(queue.flush(timeout=10))
+        self.assertEqual(sorted(written), list(range(8)))
+        self.assertEqual(queue.metrics()['dead_lettered'], 0)
+
+    def test_outage_is_not_bisected(self):
+        calls = []
+        up = []
+
+        def write_batch(rows):
+            calls.append(len(rows))
+            if not up:
+                up.append(True)
+                raise DatabaseDown("connection refused")
+
+        queue = self.make_queue(write_batch)
+        queue.put_many(list(range(8)))
+        self.assertTrue(queue.flush(timeout=10))
+        self.assertEqual(calls, [8, 8])
+
+    def test_bad_row_is_dead_lettered_and_the_rest_written(self):
+        written = []
+
+        def write_batch(rows):
+            if 3 in rows:
+                raise BadRow("row 3 is bad")
+            written.extend(rows)
+
+        queue = self.make_queue(write_batch)
+        queue.put_many(list(range(8)))
+        self.assertTrue(queue.flush(timeout=10))
+        self.assertEqual(sorted(written), [0, 1, 2, 4, 5, 6, 7])
+        self.assertEqual(queue.metrics()['dead_lettered'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,33 @@
-import time
+import datetime
+import json
 import random
 
 class Tracker:
-    def __init__(self, device_id: str):
+    def __init__(self, device_id: str, latitude: float = None, longitude: float = None,
+                 step: float = 0.0005, rng: random.Random = None):
         self.device_id = device_id
+        self.rng = rng or random.Random()
+        self.latitude = self.rng.uniform(-60, 60) if latitude is None else latitude
+        self.longitude = self.rng.uniform(-180, 180) if longitude is None else longitude
+        self.step = step
+        self.is_theft = False
 
     def generate_location(self) -> tuple:
-        """Simulate GPS coordinates and timestamp."""
-        latitude = random.uniform(-90, 90)
-        longitude = random.uniform(-180, 180)
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        return (latitude, longitude, timestamp)
+        """Simulate GPS coordinates and timestamp, walking a little from the last fix."""
+        self.latitude = min(90.0, max(-90.0, self.latitude + self.rng.gauss(0, self.step)))
+        self.longitude = (self.longitude + self.rng.gauss(0, self.step) + 180) % 360 - 180
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        return (self.latitude, self.longitude, timestamp)
 
     def ping(self) -> str:
-        """Generate an encrypted location ping."""
+        """Generate an encrypted location ping, in the format /update accepts."""
         lat, lon, ts = self.generate_location()
-        data = f"{self.device_id},{lat},{lon},{ts}"
+        data = json.dumps({
+            'device_id': self.device_id,
+            'latitude': lat,
+            'longitude': lon,
+            'timestamp': ts,
+            'is_theft': self.is_theft
+        })
         from crypto_utils import crypto
         return crypto.encrypt(data)